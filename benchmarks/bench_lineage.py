@@ -0,0 +1,247 @@
+"""
+benchmark scenarios for qliksense_fix_qvd_lineage.py, against the mock catalog
+
+each scenario generates a catalog (tables, columns, qvd fan-out, latency &
+resources - tables per resource), then runs main() in a separate process
+(stopped if it takes longer than the timeout) & records:-
+    wall time, requests made to the catalog (total & per endpoint),
+    peak RSS of the process running main(), links written & exit code
+    and the time per phase (from the fixer's run report)
+
+Usage:
+    python benchmarks/bench_lineage.py                     # all scenarios
+    python benchmarks/bench_lineage.py -s index async      # some scenarios
+    python benchmarks/bench_lineage.py -o results.json     # save the results
+
+peak RSS is read with the resource module (linux/mac only)
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from mock_edc import MockEdc, generate_tables
+
+package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name, catalog settings & the fixer command-line (-rn & -o are added)
+scenarios = [
+    {"name": "default", "tables": 500, "columns": 12, "fanout": 1, "args": []},
+    {"name": "index", "tables": 2000, "columns": 12, "fanout": 2, "args": ["-x"]},
+    {"name": "batch", "tables": 2000, "columns": 12, "fanout": 2, "args": ["-b"]},
+    {
+        "name": "async",
+        "tables": 2000,
+        "columns": 12,
+        "fanout": 2,
+        "args": ["--async"],
+    },
+    {
+        "name": "parse-workers",
+        "tables": 2000,
+        "columns": 12,
+        "fanout": 2,
+        "args": ["-x", "-pw", "2"],
+    },
+    {
+        "name": "wide",
+        "tables": 500,
+        "columns": 150,
+        "fanout": 4,
+        "args": ["-x"],
+    },
+    {
+        "name": "latency-index",
+        "tables": 1000,
+        "columns": 12,
+        "fanout": 1,
+        "latency": 0.01,
+        "args": ["-x"],
+    },
+    {
+        "name": "latency-async",
+        "tables": 1000,
+        "columns": 12,
+        "fanout": 1,
+        "latency": 0.01,
+        "args": ["--async"],
+    },
+    {
+        "name": "async-resources",
+        "tables": 500,
+        "columns": 12,
+        "fanout": 1,
+        "resources": 4,
+        "latency": 0.005,
+        "args": ["--async", "--maxinflight", "2", "-ps", "20"],
+    },
+    {
+        "name": "import",
+        "tables": 500,
+        "columns": 12,
+        "fanout": 1,
+        "args": ["-x", "-i", "-w", "-z"],
+    },
+]
+
+
+def run_main(edc_url: str, argv: list, work_folder: str, results):
+    """
+    child process - run the fixer's main() & report the wall time & peak RSS
+    """
+    sys.path.insert(0, package_folder)
+    os.chdir(work_folder)
+    os.environ["INFA_EDC_URL"] = edc_url
+    os.environ["INFA_EDC_AUTH"] = "benchmark"
+    import qliksense_fix_qvd_lineage
+
+    sys.argv = ["qliksense_fix_qvd_lineage.py"] + argv
+    with open("run.log", "w") as log, contextlib.redirect_stdout(log):
+        start = time.perf_counter()
+        exit_code = qliksense_fix_qvd_lineage.main()
+        wall_time = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024  # linux reports kb
+    results.put(
+        {"exit_code": exit_code, "seconds": wall_time, "peak_rss_mb": peak_rss / 2**20}
+    )
+
+
+def count_links(out_folder: str, resource_name: str):
+    """
+    lineage links written (csv rows) for a resource, from the csv or zip (-z)
+    """
+    csv_name = f"{resource_name}_lineage.csv"
+    zip_path = os.path.join(out_folder, f"{resource_name}_lineage.zip")
+    if os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path) as zip, zip.open(csv_name) as f:
+            return sum(1 for _ in f) - 1
+    csv_path = os.path.join(out_folder, csv_name)
+    if not os.path.exists(csv_path):
+        return None
+    with open(csv_path) as f:
+        return sum(1 for _ in f) - 1
+
+
+def run_scenario(scenario: dict, resource_name: str = "qres", timeout: float = 900):
+    resources = scenario.get("resources", 1)
+    if resources == 1:
+        resource_names = [resource_name]
+    else:
+        resource_names = [f"{resource_name}_{nbr}" for nbr in range(resources)]
+    objects = []
+    for name in resource_names:
+        objects.extend(
+            generate_tables(
+                name, scenario["tables"], scenario["columns"], scenario["fanout"]
+            )
+        )
+    edc = MockEdc(objects, latency=scenario.get("latency", 0.0)).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_lineage_") as work_folder:
+            # the lineage resource template (-i) is read from ./template
+            shutil.copytree(
+                os.path.join(package_folder, "template"),
+                os.path.join(work_folder, "template"),
+            )
+            argv = ["-rn", *resource_names, "-o", "out"] + scenario["args"]
+            context = multiprocessing.get_context("spawn")
+            results = context.Queue()
+            process = context.Process(
+                target=run_main, args=(edc.url, argv, work_folder, results)
+            )
+            process.start()
+            process.join(timeout)
+            if process.is_alive():
+                # e.g. requests waiting for a limit that is never released
+                process.terminate()
+                process.join()
+                raise RuntimeError(
+                    f"scenario {scenario['name']} did not finish in {timeout}s"
+                )
+            if process.exitcode != 0:
+                raise RuntimeError(
+                    f"scenario {scenario['name']} failed - exit code "
+                    f"{process.exitcode}, see the log in {work_folder}"
+                )
+            result = results.get()
+            links = 0
+            phases = {}
+            for name in resource_names:
+                links += count_links(os.path.join(work_folder, "out"), name) or 0
+                report_path = os.path.join(
+                    work_folder, "out", f"{name}_lineage_report.json"
+                )
+                if not os.path.exists(report_path):
+                    continue
+                with open(report_path) as f:
+                    # totals for all resources
+                    for phase, totals in json.load(f)["phases"].items():
+                        total = phases.setdefault(phase, {"seconds": 0, "count": 0})
+                        total["seconds"] += totals["seconds"]
+                        total["count"] += totals["count"]
+    finally:
+        edc.stop()
+    return {
+        **scenario,
+        **result,
+        "links": links,
+        "requests": edc.request_count,
+        "endpoints": dict(sorted(edc.endpoint_counts.items())),
+        "phases": phases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="qvd lineage fixer benchmarks")
+    parser.add_argument(
+        "-s",
+        "--scenarios",
+        nargs="+",
+        default=[],
+        help="scenario names to run - default all: "
+        + ", ".join(scenario["name"] for scenario in scenarios),
+    )
+    parser.add_argument("-o", "--output", help="json file to write the results to")
+    args = parser.parse_args()
+
+    selected = [
+        scenario
+        for scenario in scenarios
+        if not args.scenarios or scenario["name"] in args.scenarios
+    ]
+    print(
+        "scenario,resources,tables,columns,fanout,seconds,requests,peak_rss_mb,"
+        "links,exit_code"
+    )
+    results = []
+    for scenario in selected:
+        result = run_scenario(scenario)
+        results.append(result)
+        print(
+            f"{result['name']},{result.get('resources', 1)},{result['tables']},"
+            f"{result['columns']},{result['fanout']},{result['seconds']:.2f},"
+            f"{result['requests']},"
+            f"{result['peak_rss_mb']:.1f},{result['links']},{result['exit_code']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results},
+                f,
+                indent=2,
+            )
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+micro benchmark for the qlik script parsing used by qliksense_fix_qvd_lineage.py
+
+scripts are generated (see qlik_script_generator.py), then each function is
+timed (best of --repeat rounds) & reported as statements/sec and columns/sec
+    parse_qvd_loads           - parse (all statements) only
+    parse_qvd_loads(baseline) - the original split/regex parse of the same
+                                scripts (it mis-parses ; in strings, REM etc,
+                                but is the speed to stay close to)
+    extract_qvd_names         - parse (all statements) & queue the qvd links
+    extract_qvd_names(cached) - the same scripts again (parse results re-used)
+    split_column_ref          - each LOAD column of the qvd statements
+    get_field_possibles       - the expression (before AS) of each column
+
+Usage:
+    python benchmarks/bench_parser.py -o parser_v2.json
+    python benchmarks/bench_parser.py -c parser_v2.json     # compare
+    python benchmarks/bench_parser.py --qvd-ratio 1         # qvd loads only
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+from qlik_script_generator import generate_script
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import qlik_script_parser  # noqa: E402
+import qliksense_fix_qvd_lineage as fixer  # noqa: E402
+from qliksense_fix_qvd_lineage import mem  # noqa: E402
+
+
+def best_time(func, repeat: int):
+    """
+    fastest of <repeat> runs of func (seconds)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def baseline_parse(expr: str):
+    """
+    the parse of the original extract_qvd_names (without the print/file
+    output & table lookups) - split on ; then regex for [x.qvd], LOAD & FROM
+    returns {table_ref: {to_col: [fields]}}
+    """
+    qvds = {}
+    for statement in expr.split(";"):
+        for match in re.findall(r"\[([^]]+.qvd)\]", statement):
+            table_ref = match.rsplit("\\")[-1].split(".qvd")[0]
+            load_pos = statement.upper().find("LOAD")
+            from_pos = statement.upper().find("FROM")
+            col_ref_stmnt = statement[load_pos + 4 : from_pos]
+            col_ref_stmnt = re.sub(r"distinct", "", col_ref_stmnt, flags=re.I)
+            st_refs = {}
+            for qvd_col in re.split(r",\s*(?![^()]*\))", col_ref_stmnt):
+                to_col, fields = baseline_split_column_ref(qvd_col.strip())
+                st_refs[to_col] = fields
+            qvds[table_ref] = st_refs
+    return qvds
+
+
+def baseline_split_column_ref(in_ref: str):
+    # the original split_column_ref & get_field_possibles
+    to_col = in_ref
+    fm_expr = in_ref
+    split_ref = re.split(r"\s+AS\s+", in_ref, flags=re.I)
+    if len(split_ref) > 1:
+        to_col = split_ref[1]
+        fm_expr = split_ref[0]
+    if "[" in to_col:
+        to_col = to_col.replace("[", "").replace("]", "")
+    if '"' in to_col:
+        to_col = to_col.replace('"', "")
+    refs = re.findall(r'"([^"]+)"', fm_expr)
+    refs.extend(re.findall(r"\[([^]]+)\]", fm_expr))
+    if not refs:
+        refs.append(fm_expr)
+    return to_col, refs
+
+
+def bench_parse(scripts: list):
+    qlik_script_parser.parse_columns.cache_clear()
+    for script in scripts:
+        qlik_script_parser.parse_qvd_loads(script.text)
+
+
+def bench_parse_baseline(scripts: list):
+    for script in scripts:
+        baseline_parse(script.text)
+
+
+def bench_extract(scripts: list):
+    # new parse of each script - qvd links are queued (not resolved)
+    mem.parse_cache.clear()
+    qlik_script_parser.parse_columns.cache_clear()
+    mem.pending_links = []
+    for nbr, script in enumerate(scripts):
+        fixer.extract_qvd_names(script.text, f"Table_{nbr}", {"id": f"t://{nbr}"})
+
+
+def bench_extract_cached(scripts: list):
+    mem.pending_links = []
+    for nbr, script in enumerate(scripts):
+        fixer.extract_qvd_names(script.text, f"Table_{nbr}", {"id": f"t://{nbr}"})
+
+
+def bench_split_column_ref(scripts: list):
+    for script in scripts:
+        for text, expr in script.columns:
+            fixer.split_column_ref(text)
+
+
+def bench_get_field_possibles(scripts: list):
+    for script in scripts:
+        for text, expr in script.columns:
+            fixer.get_field_possibles(expr)
+
+
+def check_scripts(scripts: list):
+    """
+    the parser must find every qvd load in the generated scripts (REM comments,
+    Label:LOAD etc) - a benchmark of a wrong result is not useful
+    """
+    for script in scripts:
+        qvd_loads = qlik_script_parser.parse_qvd_loads(script.text)
+        columns = sum(len(qvd_load.columns) for qvd_load in qvd_loads)
+        if len(qvd_loads) != script.qvd_statements or columns != len(script.columns):
+            raise ValueError(
+                f"parsed {len(qvd_loads)} qvd loads ({columns} columns) - expected "
+                f"{script.qvd_statements} ({len(script.columns)} columns) in:\n"
+                + script.text
+            )
+
+
+def run_benchmarks(args):
+    rand = random.Random(args.seed)
+    scripts = [
+        generate_script(
+            rand, f"Table_{nbr}", args.statements, args.columns, args.qvd_ratio
+        )
+        for nbr in range(args.scripts)
+    ]
+    check_scripts(scripts)
+    statements = sum(script.statements for script in scripts)
+    qvd_statements = sum(script.qvd_statements for script in scripts)
+    columns = sum(len(script.columns) for script in scripts)
+
+    mem.defer_links = True
+    results = {}
+    # name: (function, statements & columns processed per run)
+    benchmarks = {
+        "parse_qvd_loads": (bench_parse, statements, columns),
+        "parse_qvd_loads(baseline)": (bench_parse_baseline, statements, columns),
+        "extract_qvd_names": (bench_extract, statements, columns),
+        "extract_qvd_names(cached)": (bench_extract_cached, statements, columns),
+        "split_column_ref": (bench_split_column_ref, qvd_statements, columns),
+        "get_field_possibles": (bench_get_field_possibles, qvd_statements, columns),
+    }
+    for name, (func, statement_count, column_count) in benchmarks.items():
+        seconds = best_time(lambda: func(scripts), args.repeat)
+        results[name] = {
+            "seconds": seconds,
+            "statements": statement_count,
+            "columns": column_count,
+            "statements_per_sec": statement_count / seconds,
+            "columns_per_sec": column_count / seconds,
+        }
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parser_version": qlik_script_parser.parser_version,
+        "python": platform.python_version(),
+        "settings": {
+            "scripts": args.scripts,
+            "statements": args.statements,
+            "columns": args.columns,
+            "qvd_ratio": args.qvd_ratio,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="qlik script parser benchmarks")
+    parser.add_argument(
+        "--scripts", default=200, type=int, help="scripts to generate - default 200"
+    )
+    parser.add_argument(
+        "--statements", default=30, type=int, help="statements per script - default 30"
+    )
+    parser.add_argument(
+        "--columns", default=20, type=int, help="max columns per LOAD - default 20"
+    )
+    parser.add_argument(
+        "--qvd-ratio",
+        default=0.5,
+        type=float,
+        help="share of the statements that load a qvd - default 0.5",
+    )
+    parser.add_argument(
+        "--repeat", default=5, type=int, help="runs of each function - default 5"
+    )
+    parser.add_argument("--seed", default=1, type=int, help="random seed - default 1")
+    parser.add_argument("-o", "--output", help="json file to write the results to")
+    parser.add_argument(
+        "-c", "--compare", help="json results of an earlier run, to compare with"
+    )
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    print("function,seconds,statements_per_sec,columns_per_sec,change")
+    for name, result in report["results"].items():
+        change = ""
+        if name in previous:
+            ratio = result["columns_per_sec"] / previous[name]["columns_per_sec"]
+            change = f"{(ratio - 1) * 100:+.1f}%"
+        print(
+            f"{name},{result['seconds']:.4f},{result['statements_per_sec']:.0f},"
+            f"{result['columns_per_sec']:.0f},{change}"
+        )
+
+    results = report["results"]
+    print(
+        "parse_qvd_loads takes %.1fx the time of the baseline parse"
+        % (
+            results["parse_qvd_loads"]["seconds"]
+            / results["parse_qvd_loads(baseline)"]["seconds"]
+        )
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
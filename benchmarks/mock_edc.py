@@ -0,0 +1,424 @@
+"""
+mock EDC catalog (http) for running the qvd lineage fixer without a catalog
+
+serves the endpoints used by qliksense_fix_qvd_lineage.py & edcutils:-
+    GET  /access/2/catalog/data/objects            search (offset, pageSize, q, fq)
+    GET  /access/1/catalog/resources/              list resources
+    GET  /access/1/catalog/resources/<name>        resource definition
+    PUT  /access/1/catalog/resources/<name>        update resource
+    POST /access/1/catalog/resources               create resource
+    POST /access/1/catalog/resources/<name>/files  upload a file
+    POST /access/2/catalog/resources/jobs/loads    start a load job
+    GET  /access/2/catalog/resources/jobs/loads/<jobId>  job status
+
+the catalog is generated - qlikSense Table objects, each table STOREs its own
+qvd & LOADs <fanout> qvds stored by other tables (some of which do not exist)
+
+Usage (stand alone):
+    python benchmarks/mock_edc.py --tables 2000 --columns 20 --fanout 2
+    INFA_EDC_URL=http://127.0.0.1:8765 INFA_EDC_AUTH=x \\
+        python qliksense_fix_qvd_lineage.py -rn qres -x
+
+Usage (in process):
+    edc = MockEdc(generate_tables("qres", 1000))
+    edc.start()
+    ... edc.url, edc.request_count ...
+    edc.stop()
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+table_class = "com.infa.ldm.bi.qlikSense.Table"
+expression_attr = "com.infa.ldm.bi.qlikSense.Expression"
+
+
+def fact(attribute_id: str, value: str):
+    return {"attributeId": attribute_id, "value": value}
+
+
+def column_expression(col_nbr: int, col_name: str):
+    """
+    one LOAD column - a mix of plain/[bracketed]/"quoted" names, AS aliases &
+    function calls (as generated by qlik)
+    """
+    style = col_nbr % 5
+    if style == 0:
+        return f"[{col_name}]"
+    if style == 1:
+        return f'"{col_name}"'
+    if style == 2:
+        return f"{col_name} AS [{col_name}]"
+    if style == 3:
+        return f"Date(Floor([{col_name}]), 'YYYY-MM-DD') AS \"{col_name}\""
+    return col_name
+
+
+def generate_tables(
+    resource_name: str,
+    tables: int,
+    columns: int = 12,
+    fanout: int = 1,
+    missing: float = 0.1,
+    apps: int = 10,
+    seed: int = 1,
+):
+    """
+    returns a list of qlikSense Table objects (catalog search result items)
+    tables  - number of tables in the resource
+    columns - columns per table
+    fanout  - qvd files LOADed by each table (stored by other tables)
+    missing - fraction of the LOADed qvds that no table stores
+    """
+    rand = random.Random(seed)
+    col_names = [f"Col_{nbr}" for nbr in range(columns)]
+    objects = []
+    for table_nbr in range(tables):
+        name = f"Table_{table_nbr}"
+        app = f"App_{table_nbr % apps}"
+        table_id = f"{resource_name}://{app}/{name}"
+        col_list = ", ".join(
+            column_expression(nbr, col) for nbr, col in enumerate(col_names)
+        )
+        statements = [f"{name}:\nLOAD {col_list}\nFROM [lib://DB/{name}.xlsx] (ooxml)"]
+        for _ in range(fanout if table_nbr > 0 else 0):
+            if rand.random() < missing:
+                source = f"Missing_{rand.randrange(max(1, tables // 10))}"
+            else:
+                source = f"Table_{rand.randrange(table_nbr)}"
+            distinct = "DISTINCT " if rand.random() < 0.3 else ""
+            statements.append(
+                f"Concatenate ({name})\nLOAD {distinct}{col_list}\n"
+                f"FROM [lib://Data\\{resource_name}\\{source}.qvd] (qvd)"
+            )
+        statements.append(
+            f"STORE {name} INTO [lib://Data\\{resource_name}\\{name}.qvd] (qvd)"
+        )
+        statements.append(f"DROP TABLE {name}")
+        objects.append(
+            {
+                "id": table_id,
+                "facts": [
+                    fact("core.name", name),
+                    fact("core.classType", table_class),
+                    fact("core.resourceName", resource_name),
+                    fact(expression_attr, ";\n".join(statements) + ";\n"),
+                ],
+                "srcLinks": [
+                    {
+                        "association": "com.infa.ldm.bi.qlikSense.ApplicationTable",
+                        "name": app,
+                        "id": f"{resource_name}://{app}",
+                    }
+                ],
+                "dstLinks": [
+                    {
+                        "association": "com.infa.ldm.bi.qlikSense.TableColumn",
+                        "name": col,
+                        "id": f"{table_id}/{col}",
+                    }
+                    for col in col_names
+                ],
+            }
+        )
+    return objects
+
+
+def filter_values(query: str):
+    """
+    "x" or ("a" OR "b") or x - returns the list of values
+    """
+    query = query.strip()
+    if query.startswith("("):
+        values = re.findall(r'"((?:[^"\\]|\\.)*)"', query)
+        return [value.replace('\\"', '"') for value in values]
+    return [query.strip('"')]
+
+
+class MockEdc:
+    """
+    generated catalog objects, served over http (on a background thread)
+    """
+
+    def __init__(
+        self,
+        objects: list,
+        port: int = 0,
+        latency: float = 0.0,
+        job_time: float = 1.0,
+        resource_type: str = "QlikSense",
+    ):
+        self.objects = objects
+        self.port = port
+        self.latency = latency
+        self.job_time = job_time
+        self.resource_type = resource_type
+        self.qlik_resources = []
+        self.by_resource = {}  # key = resource name, val=list of objects
+        self.by_name = {}  # key = (resource name, table name), val=list of objects
+        for object in objects:
+            facts = {f["attributeId"]: f["value"] for f in object["facts"]}
+            resource_name = facts["core.resourceName"]
+            if resource_name not in self.by_resource:
+                self.by_resource[resource_name] = []
+                self.qlik_resources.append(resource_name)
+            self.by_resource[resource_name].append(object)
+            self.by_name.setdefault((resource_name, facts["core.name"]), []).append(
+                object
+            )
+        self.resources = {}  # custom lineage resources created/updated
+        self.jobs = {}
+        self.uploads = []  # (resource name, bytes)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.endpoint_counts = {}
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_count = 0
+            self.endpoint_counts = {}
+
+    def count(self, method: str, endpoint: str):
+        with self.lock:
+            self.request_count += 1
+            key = f"{method} {endpoint}"
+            self.endpoint_counts[key] = self.endpoint_counts.get(key, 0) + 1
+
+    def search(self, params: dict):
+        """
+        the objects matching the q & fq parameters (resource/name/class type)
+        """
+        filters = params.get("fq", []) + params.get("q", [])
+        resource_names = None
+        table_names = None
+        class_types = None
+        for query in filters:
+            attribute, _, value = query.partition(":")
+            if attribute == "core.resourceName":
+                resource_names = filter_values(value)
+            elif attribute == "core.name":
+                table_names = filter_values(value)
+            elif attribute == "core.classType":
+                class_types = filter_values(value)
+        if class_types is not None and table_class not in class_types:
+            return []
+        if resource_names is None:
+            resource_names = self.qlik_resources
+        if table_names is None:
+            hits = []
+            for resource_name in resource_names:
+                hits.extend(self.by_resource.get(resource_name, []))
+            return hits
+        return [
+            object
+            for resource_name in resource_names
+            for table_name in table_names
+            for object in self.by_name.get((resource_name, table_name), [])
+        ]
+
+    def job_status(self, job_id: str):
+        job = self.jobs[job_id]
+        elapsed = time.time() - job["start"]
+        if elapsed >= self.job_time:
+            status = "COMPLETED"
+        elif elapsed >= self.job_time / 4:
+            status = "RUNNING"
+        else:
+            status = "QUEUED"
+        return {
+            "jobId": job_id,
+            "resourceName": job["resourceName"],
+            "status": status,
+            "startTime": int(job["start"] * 1000),
+            "endTime": int((job["start"] + self.job_time) * 1000)
+            if status == "COMPLETED"
+            else 0,
+            "tasks": [{"taskType": "Metadata Load", "status": status}],
+        }
+
+    def handler(self):
+        edc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers & body are separate writes - avoid the delayed ack wait
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status: int, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    return self.rfile.read(length)
+                if self.headers.get("Transfer-Encoding") != "chunked":
+                    return b""
+                data = b""
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return data
+                    data += self.rfile.read(size)
+                    self.rfile.readline()
+
+            def route(self, method: str):
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                body = self.read_body() if method != "GET" else b""
+                if edc.latency:
+                    time.sleep(edc.latency)
+
+                if method == "GET" and path == "/access/2/catalog/data/objects":
+                    edc.count(method, "objects")
+                    params = parse_qs(url.query)
+                    hits = edc.search(params)
+                    offset = int(params.get("offset", ["0"])[0])
+                    page_size = int(params.get("pageSize", ["20"])[0])
+                    return self.send_json(
+                        200,
+                        {
+                            "metadata": {"totalCount": len(hits)},
+                            "items": hits[offset : offset + page_size],
+                        },
+                    )
+                if path == "/access/1/catalog/resources":
+                    edc.count(method, "resources")
+                    if method == "POST":
+                        resource = json.loads(body)
+                        name = resource["resourceIdentifier"]["resourceName"]
+                        edc.resources[name] = resource
+                        return self.send_json(200, resource)
+                    return self.send_json(
+                        200,
+                        [
+                            {
+                                "resourceName": name,
+                                "resourceTypeName": edc.resource_type,
+                            }
+                            for name in edc.qlik_resources
+                        ]
+                        + [
+                            {"resourceName": name, "resourceTypeName": "Custom Lineage"}
+                            for name in edc.resources
+                        ],
+                    )
+                match = re.match(r"/access/1/catalog/resources/([^/]+)(/files)?$", path)
+                if match and match.group(2) and method == "POST":
+                    edc.count(method, "resources/files")
+                    edc.uploads.append((match.group(1), len(body)))
+                    return self.send_json(200, {})
+                if match and not match.group(2):
+                    edc.count(method, "resources/<name>")
+                    if method == "PUT":
+                        edc.resources[match.group(1)] = json.loads(body)
+                        return self.send_json(200, {})
+                    resource = edc.resources.get(match.group(1))
+                    if resource is None:
+                        return self.send_json(404, {"message": "resource not found"})
+                    return self.send_json(200, resource)
+                jobs_path = "/access/2/catalog/resources/jobs/loads"
+                if method == "POST" and path == jobs_path:
+                    edc.count(method, "jobs/loads")
+                    job_id = f"job_{len(edc.jobs) + 1}"
+                    edc.jobs[job_id] = {
+                        "start": time.time(),
+                        "resourceName": json.loads(body)["resourceName"],
+                    }
+                    return self.send_json(200, edc.job_status(job_id))
+                match = re.match(jobs_path + r"/([^/]+)$", path)
+                if method == "GET" and match and match.group(1) in edc.jobs:
+                    edc.count(method, "jobs/loads/<jobId>")
+                    return self.send_json(200, edc.job_status(match.group(1)))
+                edc.count(method, "other")
+                return self.send_json(404, {"message": f"{path} not found"})
+
+            def do_GET(self):
+                self.route("GET")
+
+            def do_PUT(self):
+                self.route("PUT")
+
+            def do_POST(self):
+                self.route("POST")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="mock EDC catalog for qliksense tables"
+    )
+    parser.add_argument("--port", default=8765, type=int, help="default 8765")
+    parser.add_argument(
+        "--resources",
+        nargs="+",
+        default=["qres"],
+        help="qliksense resource names to generate - default qres",
+    )
+    parser.add_argument("--tables", default=1000, type=int, help="tables per resource")
+    parser.add_argument("--columns", default=12, type=int, help="columns per table")
+    parser.add_argument(
+        "--fanout", default=1, type=int, help="qvd files loaded by each table"
+    )
+    parser.add_argument(
+        "--missing",
+        default=0.1,
+        type=float,
+        help="fraction of loaded qvds that are not stored by any table",
+    )
+    parser.add_argument(
+        "--latency", default=0.0, type=float, help="seconds added to each request"
+    )
+    parser.add_argument(
+        "--job-time", default=1.0, type=float, help="seconds for a load job to complete"
+    )
+    args = parser.parse_args()
+
+    objects = []
+    for resource_name in args.resources:
+        objects.extend(
+            generate_tables(
+                resource_name, args.tables, args.columns, args.fanout, args.missing
+            )
+        )
+    edc = MockEdc(objects, args.port, args.latency, args.job_time).start()
+    print(f"mock EDC: {edc.url} - {len(objects)} tables in {args.resources}")
+    try:
+        edc.thread.join()
+    except KeyboardInterrupt:
+        edc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+generator for realistic qlik load scripts (table expressions) - for benchmarks
+
+a script has SET/LET variables, comments (incl. REM with an unmatched '),
+resident & database loads and LOAD ... FROM <x.qvd> (qvd) statements (some
+with a Label:LOAD prefix), with columns that use [bracketed] & "quoted" names,
+AS aliases, DISTINCT, nested function calls with commas and 'strings'
+containing ; and , characters
+
+Usage:
+    rand = random.Random(1)
+    script = generate_script(rand, "Orders", statements=30, columns=20)
+    script.text            # the expression
+    script.statements      # number of ; separated statements
+    script.qvd_statements  # number of LOAD ... FROM <x.qvd> statements
+    script.columns         # list of (column text, expression before AS)
+"""
+import random
+from collections import namedtuple
+
+Script = namedtuple("Script", ["text", "statements", "qvd_statements", "columns"])
+
+field_words = [
+    "Order",
+    "Customer",
+    "Product",
+    "Amount",
+    "Quantity",
+    "Region",
+    "Sales Rep",
+    "Ship Date",
+    "Status",
+    "Currency",
+    "Discount %",
+    "Category",
+]
+
+
+def field_name(rand: random.Random, nbr: int):
+    return f"{rand.choice(field_words)} {nbr}"
+
+
+def quote_field(rand: random.Random, name: str):
+    """
+    [bracketed] or "quoted" - or plain, if the name has no spaces etc
+    """
+    plain = name.replace(" ", "_").replace("%", "Pct")
+    style = rand.randrange(3)
+    if style == 0:
+        return f"[{name}]"
+    if style == 1:
+        return f'"{name}"'
+    return plain
+
+
+def column_expression(rand: random.Random, nbr: int):
+    """
+    returns the text of one LOAD column & its expression (the part before AS)
+    """
+    name = field_name(rand, nbr)
+    field = quote_field(rand, name)
+    other = quote_field(rand, field_name(rand, nbr + 1))
+    style = rand.randrange(8)
+    if style == 0:
+        expr = field
+    elif style == 1:
+        expr = f"Upper(Trim({field}))"
+    elif style == 2:
+        expr = f"Date(Floor({field}), 'YYYY-MM-DD')"
+    elif style == 3:
+        expr = f"If(Len(Trim({field})) > 0, Upper(Left({other}, 3)), 'n/a; none')"
+    elif style == 4:
+        expr = f"ApplyMap('Map_{nbr}', {field}, 'unknown, check')"
+    elif style == 5:
+        expr = f"Num({field} * (1 - {other} / 100), '#,##0.00')"
+    elif style == 6:
+        expr = f"{field} & ' - ' & {other}"
+    else:
+        expr = f"Date#(SubField({field}, '|', 2), 'DD/MM/YYYY')"
+    if style == 0 and rand.random() < 0.5:
+        return expr, expr
+    alias = rand.choice(["[", '"', ""])
+    alias_name = f"{name} Out" if alias else f"Col_{nbr}_Out"
+    close = {"[": "]", '"': '"', "": ""}[alias]
+    return f"{expr} AS {alias}{alias_name}{close}", expr
+
+
+def generate_script(
+    rand: random.Random,
+    table_name: str,
+    statements: int = 30,
+    columns: int = 20,
+    qvd_ratio: float = 0.5,
+):
+    """
+    returns a Script with <statements> statements of up to <columns> columns,
+    about <qvd_ratio> of them LOAD ... FROM <x.qvd> (qvd)
+    """
+    parts = [
+        f"// generated script for {table_name}\n"
+        "SET ThousandSep=',';\nSET DateFormat='DD/MM/YYYY';\n"
+        f"LET vLoadTime = Now();\n/* loads for {table_name}; qvd & resident */\n"
+        f"{table_name}:\nLOAD * INLINE [\nKey, Value\n1, a\n]",
+        f"REM don't reload {table_name} here - it's loaded from the qvds below",
+    ]
+    statement_count = 5
+    qvd_count = 0
+    all_columns = []
+    for st_nbr in range(statements - statement_count - 1):
+        col_count = rand.randint(max(1, columns // 2), columns)
+        cols = [column_expression(rand, nbr) for nbr in range(col_count)]
+        col_list = ",\n    ".join(text for text, expr in cols)
+        prefix = rand.choice(
+            ["", "Concatenate ", f"Left Join ({table_name}) ", f"Stage_{st_nbr}:"]
+        )
+        distinct = "DISTINCT " if rand.random() < 0.3 else ""
+        kind = rand.random()
+        if kind < qvd_ratio:
+            folder = rand.choice(["Data\\Sales", "Data/Finance", "Extract\\Stage_1"])
+            qvd = f"lib://{folder}\\Table_{rand.randrange(1000)}.qvd"
+            quote = rand.choice(["[]", "''", '""'])
+            source = f"FROM {quote[0]}{qvd}{quote[1]} (qvd)"
+            qvd_count += 1
+            all_columns.extend(cols)
+        elif kind < qvd_ratio + 0.2:
+            source = f"RESIDENT {table_name}"
+        else:
+            source = (
+                f"FROM [lib://DB/extract_{st_nbr}.xlsx] "
+                '(ooxml, embedded labels, table is "Sheet1")'
+            )
+        where = ""
+        if rand.random() < 0.3:
+            where = "\nWHERE Exists(Key) AND Len(Status) > 0"
+        parts.append(f"{prefix}LOAD {distinct}\n    {col_list}\n{source}{where}")
+        statement_count += 1
+    parts.append(f"STORE {table_name} INTO [lib://Data\\{table_name}.qvd] (qvd)")
+    text = ";\n".join(parts) + ";\n"
+    return Script(text, statement_count + 1, qvd_count, all_columns)
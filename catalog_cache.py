@@ -0,0 +1,195 @@
+"""
+persistent (sqlite) cache of catalog objects, shared across runs
+
+objects are stored as json, keyed by resource name + object name (or id)
+    - entries older than ttl seconds are ignored (and re-read from the catalog)
+    - the cache is capped at max_entries, least recently used entries are removed
+    - names that were not found (or not unique) are stored separately, with a
+      shorter not_found_ttl, so they are not searched for again on every run
+    - can be shared by threads (e.g. >1 resource processed at the same time)
+    - writes are committed every commit_every puts or commit_interval seconds,
+      so a run that fails part way keeps (most of) what it read
+
+Usage:
+    cache = CatalogCache("out/catalog_cache.db", ttl=86400, max_entries=100000)
+    obj = cache.get(resource_name, table_name)
+    if obj is None:
+        obj = <search the catalog>
+        cache.put(resource_name, table_name, obj)
+    ...
+    cache.close()
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """
+    sqlite backed key/value store for catalog objects (json)
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: int = 86400,
+        max_entries: int = 100000,
+        not_found_ttl: int = 3600,
+        commit_every: int = 100,
+        commit_interval: float = 5.0,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "create table if not exists catalog_objects ("
+            " resource text, key text, value text, created real, accessed real,"
+            " primary key (resource, key))"
+        )
+        self.conn.execute(
+            "create index if not exists catalog_objects_accessed"
+            " on catalog_objects (accessed)"
+        )
+        self.conn.execute(
+            "create table if not exists not_found ("
+            " resource text, key text, found_count integer, created real,"
+            " primary key (resource, key))"
+        )
+        self.conn.commit()
+
+    def get(self, resource: str, key: str):
+        """
+        returns the cached object (dict) or None if not cached or expired
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "select value, created from catalog_objects"
+                " where resource=? and key=?",
+                (resource, key),
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "update catalog_objects set accessed=? where resource=? and key=?",
+                (time.time(), resource, key),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, resource: str, key: str, obj: dict):
+        """
+        add or replace a cached object
+        """
+        now = time.time()
+        value = json.dumps(obj)
+        with self.lock:
+            self.conn.execute(
+                "insert or replace into catalog_objects values (?, ?, ?, ?, ?)",
+                (resource, key, value, now, now),
+            )
+            self._written()
+
+    def is_not_found(self, resource: str, key: str):
+        """
+        returns True if key was not found (or not unique) within not_found_ttl
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "select created from not_found where resource=? and key=?",
+                (resource, key),
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= self.not_found_ttl
+
+    def put_not_found(self, resource: str, key: str, found_count: int = 0):
+        """
+        record a key that returned 0 or >1 objects
+        """
+        with self.lock:
+            self.conn.execute(
+                "insert or replace into not_found values (?, ?, ?, ?)",
+                (resource, key, found_count, time.time()),
+            )
+            self._written()
+
+    def _written(self):
+        # commit in batches (lock is held by the caller)
+        self.uncommitted += 1
+        if (
+            self.uncommitted >= self.commit_every
+            or time.monotonic() - self.last_commit >= self.commit_interval
+        ):
+            self._commit()
+
+    def _commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def clear(self, resource: str):
+        """
+        remove all cached objects for a resource (e.g. --refresh-cache)
+        """
+        with self.lock:
+            self.conn.execute(
+                "delete from catalog_objects where resource=?", (resource,)
+            )
+            self.conn.execute("delete from not_found where resource=?", (resource,))
+            self._commit()
+
+    def evict(self):
+        """
+        remove expired entries, then the least recently used entries over max_entries
+        returns the number of entries removed
+        """
+        with self.lock:
+            removed = self.conn.execute(
+                "delete from catalog_objects where created < ?",
+                (time.time() - self.ttl,),
+            ).rowcount
+            removed += self.conn.execute(
+                "delete from not_found where created < ?",
+                (time.time() - self.not_found_ttl,),
+            ).rowcount
+            count = self.conn.execute(
+                "select count(*) from catalog_objects"
+            ).fetchone()[0]
+            if count > self.max_entries:
+                removed += self.conn.execute(
+                    "delete from catalog_objects where rowid in ("
+                    " select rowid from catalog_objects order by accessed limit ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            self._commit()
+        return removed
+
+    def close(self):
+        """
+        apply the size cap, save & close the database
+        """
+        removed = self.evict()
+        logger.info(
+            "catalog cache %s: hits=%d misses=%d evicted=%d",
+            self.db_path,
+            self.hits,
+            self.misses,
+            removed,
+        )
+        self.conn.close()
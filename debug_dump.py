@@ -0,0 +1,78 @@
+"""
+debug dump of table expressions & qvd load statements (--debug-dump)
+
+entries are queued & written by a background thread into a single zip
+archive - so the callers are not blocked by file i/o, and a run creates
+one file (not one per table/statement)
+
+Usage:
+    dump = DebugDump("out/debug_dump.zip")
+    dump.write("qres/Orders", table_expr)
+    ...
+    dump.close()                         # waits for the queued entries
+"""
+import logging
+import os
+import queue
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+
+class DebugDump:
+    """
+    zip archive of text entries, written by a background thread
+    """
+
+    def __init__(self, zip_path: str, max_queued: int = 1000):
+        self.zip_path = zip_path
+        folder = os.path.dirname(zip_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.names = set()
+        self.entries = 0
+        # bounded - callers wait if the writer falls behind (memory is capped)
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.zip = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED)
+        self.thread = threading.Thread(
+            target=self._writer, name="debug_dump", daemon=True
+        )
+        self.thread.start()
+
+    def write(self, name: str, text: str):
+        """
+        queue a text entry for the archive (carriage returns removed)
+        """
+        self.queue.put((name, text))
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            name, text = item
+            try:
+                self.zip.writestr(self._unique_name(name), text.replace("\r", ""))
+                self.entries += 1
+            except Exception as error:
+                logger.error("unable to write %s to %s: %s", name, self.zip_path, error)
+
+    def _unique_name(self, name: str):
+        # tables can have the same name (e.g. in different apps)
+        unique_name = name
+        count = 1
+        while unique_name in self.names:
+            count += 1
+            unique_name = f"{name}_{count}"
+        self.names.add(unique_name)
+        return unique_name
+
+    def close(self):
+        """
+        write any queued entries & close the archive
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.zip.close()
+        logger.info("debug dump written: %s (%d entries)", self.zip_path, self.entries)
@@ -13,6 +13,11 @@ uses command-line args to easily define common connection properties for edc
     -a --auth    base64 encoded credentials see encodeUser.py
     -u --user    (not preferred) but can be passed (will prompt for pwd)
     -s --sslcert https certificate if needed
+    --retries    number of retries for 429/5xx responses & connection errors
+    --maxinflight max concurrent requests - adaptive (AIMD) limit, 0=no limit
+
+all requests made with edcSession.session are retried (jittered exponential
+backoff, honouring Retry-After) - see RetrySession & AdaptiveLimiter
 
 Usage:
     edcSession = EDCSession()
@@ -21,19 +26,246 @@ Usage:
     ...
     resp = edcSession.session.get(resourceUrl, params=(), timeout=10)
 
-Note: this is syncronyous version - not async
+Note: EDCSession is the syncronyous version, for async (aiohttp) use EDCAsyncSession
+    edcSession = EDCAsyncSession(max_concurrency=16)
+    edcSession.initUrlAndSessionFromEDCSettings()
+    ...
+    async with edcSession:
+        status, result_json = await edcSession.getJson(url, params={...})
 """
 import argparse
+import asyncio
 import os
 import base64
 import getpass
+import logging
+import random
+import ssl
+import threading
+import time
 import requests
-from urllib.parse import urljoin
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlsplit
 
 # from pathlib import Path
 import pathlib
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+# responses that are retried - catalog busy/unavailable
+retry_status_codes = (429, 500, 502, 503, 504)
+# methods that are safe to repeat (POST is only retried for 429 - not processed)
+retry_methods = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+# longest Retry-After (seconds) that will be honoured
+max_retry_after = 300
+
+
+def retry_delay(attempt: int, backoff: float, max_backoff: float, retry_after=None):
+    """
+    seconds to wait before retry number <attempt> (1..n)
+    exponential backoff with full jitter, or the Retry-After header value
+    (seconds or http date) if that is longer
+    """
+    delay = random.uniform(0, min(max_backoff, backoff * 2**attempt))
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = (
+                    parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)
+                ).total_seconds()
+            except (TypeError, ValueError):
+                wait = 0
+        delay = max(delay, min(wait, max_retry_after))
+    return delay
+
+
+class AdaptiveLimiter:
+    """
+    AIMD (additive increase/multiplicative decrease) limit for concurrent requests
+
+    - an ok response adds 1/limit (about +1 for each limit requests), up to max_limit
+    - an error (429/5xx/connection) or slow response halves the limit (at most
+      once per cooldown seconds, so a burst of errors is counted once)
+      slow = latency > latency_factor * baseline (fastest recent) latency of
+      the endpoint - e.g. a page of search results is slower than a lookup
+    used by RetrySession (threads - acquire/release) & EDCAsyncSession
+    (acquire_async/release), one limit for all threads & event loops
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        latency_factor: float = 3.0,
+        cooldown: float = 1.0,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        # endpoint: baseline latency
+        self.base_latency = {}
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.condition = threading.Condition()
+        # (event loop, future) of each waiting acquire_async
+        self.async_waiters = []
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire(self):
+        """
+        wait until a request can be started (threads)
+        """
+        with self.condition:
+            while not self.has_capacity():
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """
+        wait until a request can be started (asyncio) - the limit can be
+        released by other threads/event loops, so they wake this one
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.has_capacity():
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, latency: float, ok: bool, endpoint: str = ""):
+        """
+        a request finished - adjust the limit using the latency & result
+        endpoint - e.g. GET /access/2/catalog/data/objects (latency baseline)
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.update(latency, ok, endpoint)
+            self.condition.notify_all()
+            for loop, waiter in self.async_waiters:
+                try:
+                    loop.call_soon_threadsafe(wake_waiter, waiter)
+                except RuntimeError:
+                    # the event loop is closed
+                    pass
+            self.async_waiters = []
+
+    def update(self, latency: float, ok: bool, endpoint: str = ""):
+        slow = False
+        if ok:
+            # baseline - drops to a faster latency, slowly follows slower ones
+            base_latency = self.base_latency.get(endpoint)
+            if base_latency is None or latency < base_latency:
+                base_latency = latency
+            else:
+                base_latency = 0.95 * base_latency + 0.05 * latency
+            self.base_latency[endpoint] = base_latency
+            slow = latency > self.latency_factor * base_latency
+
+        if ok and not slow:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif time.monotonic() - self.last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.last_decrease = time.monotonic()
+            self.decreases += 1
+
+
+def wake_waiter(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RetrySession(requests.Session):
+    """
+    requests.Session that retries 429/5xx responses & connection errors
+    (retries times, jittered exponential backoff, honours Retry-After) and
+    optionally limits concurrent requests (threads) with an AdaptiveLimiter
+    """
+
+    def __init__(
+        self,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        limiter: AdaptiveLimiter = None,
+    ):
+        super().__init__()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self.retry_count = 0
+
+    def request(self, method, url, *args, **kwargs):
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            start = time.monotonic()
+            resp = None
+            error = None
+            try:
+                resp = super().request(method, url, *args, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                error = e
+            ok = error is None and resp.status_code not in retry_status_codes
+            if self.limiter is not None:
+                endpoint = f"{method.upper()} {urlsplit(url).path}"
+                self.limiter.release(time.monotonic() - start, ok, endpoint)
+
+            if ok:
+                return resp
+            if attempt >= self.retries or not self.can_retry(method, resp, error):
+                if error is not None:
+                    raise error
+                return resp
+
+            attempt += 1
+            self.retry_count += 1
+            retry_after = resp.headers.get("Retry-After") if resp is not None else None
+            delay = retry_delay(attempt, self.backoff, self.max_backoff, retry_after)
+            reason = error if error is not None else resp.status_code
+            logger.warning(
+                "%s %s failed (%s) - retry %d of %d in %.1fs",
+                method,
+                url,
+                reason,
+                attempt,
+                self.retries,
+                delay,
+            )
+            time.sleep(delay)
+            # file uploads - re-read the file(s) from the start
+            for file_tuple in (kwargs.get("files") or {}).values():
+                if hasattr(file_tuple[1], "seek"):
+                    file_tuple[1].seek(0)
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)
+
+    def can_retry(self, method, resp, error):
+        """
+        only repeat requests that can't have been processed twice
+        """
+        if method.upper() in retry_methods:
+            return True
+        if resp is not None:
+            return resp.status_code == 429
+        return isinstance(error, requests.exceptions.ConnectTimeout)
+
 
 class EDCSession:
     """
@@ -50,6 +282,8 @@ class EDCSession:
         self.edcversion_str = ""
         self.edc_build_vers = ""
         self.edc_build_date = ""
+        self.retries = 3
+        self.max_inflight = 0
 
     def __setup_standard_cmdargs__(self):
         # check for args overriding the env vars
@@ -101,6 +335,26 @@ class EDCSession:
             ),
             type=str,
         )
+        self.argparser.add_argument(
+            "--retries",
+            required=False,
+            default=3,
+            help=(
+                "number of times to retry a request for 429/5xx responses "
+                "& connection errors - default 3"
+            ),
+            type=int,
+        )
+        self.argparser.add_argument(
+            "--maxinflight",
+            required=False,
+            default=0,
+            help=(
+                "max concurrent requests - adaptive limit (AIMD), reduced when "
+                "the catalog is slow or returns errors. default 0 (no limit)"
+            ),
+            type=int,
+        )
 
     def initUrlAndSessionFromEDCSettings(self):
         """
@@ -212,8 +466,11 @@ class EDCSession:
                 "-c/--edcurl parameter - exiting"
             )
 
+        self.retries = args.retries
+        self.max_inflight = args.maxinflight
+
         # create a session
-        self.session = requests.Session()
+        self.session = self.createSession()
         # session.headers.update({"Accept": "application/json"})
         self.session.verify = verify
         self.session.headers.update({"Authorization": auth})
@@ -226,7 +483,7 @@ class EDCSession:
         given a valid URL and auth - setup a requests session to use
         for subsequent calls, verify can be False
         """
-        self.session = requests.Session()
+        self.session = self.createSession()
         self.baseUrl = catalog_url
         self.session.baseUrl = self.baseUrl
         self.session.headers.update({"Authorization": catalog_auth})
@@ -234,6 +491,15 @@ class EDCSession:
             verify = False
         self.session.verify = verify
 
+    def createSession(self):
+        """
+        returns a RetrySession using the retries/maxinflight settings
+        """
+        limiter = None
+        if self.max_inflight > 0:
+            limiter = AdaptiveLimiter(self.max_inflight)
+        return RetrySession(retries=self.retries, limiter=limiter)
+
     def validateConnection(self):
         """
         validate that the connection informatioon (url + auth credentials)
@@ -277,3 +543,136 @@ class EDCSession:
             print(e)
             # exit if we can't connect
             return 0, None
+
+
+class EDCAsyncSession(EDCSession):
+    """
+    async version of EDCSession - same env/.env/command-line settings, with
+    a pooled aiohttp client session (max_concurrency open connections/requests)
+    the requests session (self.session) is still created, for sync calls
+    aiohttp is only needed (imported) when the async session is opened
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.async_session = None
+        self.semaphore: asyncio.Semaphore = None
+        self.limiter: AdaptiveLimiter = None
+        self.retry_count = 0
+        # called with (method, url, status, seconds) for each response
+        self.response_hooks = []
+
+    def initFromSession(self, edcSession: EDCSession):
+        """
+        use the url, auth & verify settings of an initialized EDCSession
+        (no need to read the env/.env/command-line settings again)
+        """
+        self.baseUrl = edcSession.baseUrl
+        self.session = edcSession.session
+        self.retries = edcSession.retries
+        self.max_inflight = edcSession.max_inflight
+
+    async def open(self):
+        """
+        create the aiohttp client session - must be called in the event loop
+        """
+        import aiohttp
+
+        verify = self.session.verify
+        if verify is False:
+            ssl_context = False
+        elif isinstance(verify, str):
+            ssl_context = ssl.create_default_context(cafile=verify)
+        else:
+            ssl_context = None
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=ssl_context)
+        self.async_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": self.session.headers.get("Authorization")},
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # share the adaptive limit with the sync session & the async sessions
+        # of other resources (each in their own thread & event loop)
+        self.limiter = getattr(self.session, "limiter", None)
+
+    async def close(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def getJson(self, url: str, params: dict = None):
+        """
+        GET url (max_concurrency at a time, or the adaptive limit if lower)
+        params values can be lists (e.g. fq) - each value is sent
+        429/5xx responses & connection errors are retried (same as RetrySession)
+        returns:
+            status code
+            json (or response text if not 200)
+        """
+        import aiohttp
+
+        query = []
+        for key, value in (params or {}).items():
+            for item in value if isinstance(value, list) else [value]:
+                query.append((key, str(item)))
+
+        attempt = 0
+        while True:
+            status = None
+            result = None
+            retry_after = None
+            error = None
+            async with self.semaphore:
+                if self.limiter is not None:
+                    await self.limiter.acquire_async()
+                start = time.monotonic()
+                ok = False
+                try:
+                    try:
+                        async with self.async_session.get(url, params=query) as resp:
+                            status = resp.status
+                            retry_after = resp.headers.get("Retry-After")
+                            if status == 200:
+                                result = await resp.json()
+                            else:
+                                result = await resp.text()
+                    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                        error = e
+                    if status is not None:
+                        for hook in self.response_hooks:
+                            hook("GET", url, status, time.monotonic() - start)
+                    ok = error is None and status not in retry_status_codes
+                finally:
+                    # (also if cancelled - the limit is shared with other resources)
+                    if self.limiter is not None:
+                        endpoint = f"GET {urlsplit(url).path}"
+                        self.limiter.release(time.monotonic() - start, ok, endpoint)
+
+            if ok:
+                return status, result
+            if attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return status, result
+
+            attempt += 1
+            self.retry_count += 1
+            delay = retry_delay(attempt, 0.5, 30, retry_after)
+            reason = error if error is not None else status
+            logger.warning(
+                "GET %s failed (%s) - retry %d of %d in %.1fs",
+                url,
+                reason,
+                attempt,
+                self.retries,
+                delay,
+            )
+            await asyncio.sleep(delay)
@@ -9,7 +9,119 @@ utility functions for processing catalog objects
 import requests
 import json
 from requests.auth import HTTPBasicAuth
+import hashlib
 import os
+import time
+import uuid
+import zipfile
+
+
+class CatalogObject(dict):
+    """
+    a catalog object (item from /access/2/catalog/data/objects) with the facts,
+    srcLinks and dstLinks indexed once, when created
+    - can still be used as a dict (e.g. obj["id"], json.dumps(obj))
+    """
+
+    def __init__(self, item: dict):
+        super().__init__(item)
+        # key = attributeId, val = value (first fact wins - same as getFactValue)
+        self.facts = {}
+        for fact in item.get("facts", []):
+            self.facts.setdefault(fact.get("attributeId"), fact.get("value"))
+        # key = association, val = list of links
+        self.srcLinks = {}
+        for link in item.get("srcLinks", []):
+            self.srcLinks.setdefault(link.get("association"), []).append(link)
+        self.dstLinks = {}
+        for link in item.get("dstLinks", []):
+            self.dstLinks.setdefault(link.get("association"), []).append(link)
+
+    def __reduce__(self):
+        # re-index when un-pickled (e.g. passed to another process)
+        return (CatalogObject, (dict(self),))
+
+    def getFactValue(self, attrName):
+        """
+        returns the value of a fact (attribute) or ""
+        """
+        return self.facts.get(attrName, "")
+
+    def getSrcLinks(self, association):
+        """
+        returns the list of srcLinks for an association (or [])
+        """
+        return self.srcLinks.get(association, [])
+
+    def getDstLinks(self, association):
+        """
+        returns the list of dstLinks for an association (or [])
+        """
+        return self.dstLinks.get(association, [])
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data body for a file upload, read from disk as it is sent
+    (requests builds the whole body in memory when using files=)
+    - the length is known, so the body is sent with a Content-Length header
+    """
+
+    def __init__(self, fields: dict, fileName, fullPath, mimeType):
+        boundary = uuid.uuid4().hex
+        self.contentType = "multipart/form-data; boundary=" + boundary
+        head = ""
+        for name, value in fields.items():
+            head += (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            )
+        head += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{fileName}"\r\n'
+            f"Content-Type: {mimeType}\r\n\r\n"
+        )
+        self.head = head.encode("utf-8")
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.file = open(fullPath, "rb")
+        self.length = len(self.head) + os.path.getsize(fullPath) + len(self.tail)
+        self.parts = []
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def seek(self, offset, whence=0):
+        """
+        only a seek to the start is supported (to re-send the body)
+        """
+        self.file.seek(0)
+        self.parts = [self.head, self.file, self.tail]
+
+    def read(self, size=-1):
+        chunk = b""
+        while self.parts and (size < 0 or len(chunk) < size):
+            part = self.parts[0]
+            want = -1 if size < 0 else size - len(chunk)
+            if isinstance(part, bytes):
+                data = part if want < 0 else part[:want]
+                self.parts[0] = part[len(data) :]
+            else:
+                data = part.read(want)
+            if not data or not self.parts[0]:
+                self.parts.pop(0)
+            chunk += data
+        return chunk
+
+    def close(self):
+        self.file.close()
 
 
 def getFactValue(item, attrName):
@@ -17,9 +129,11 @@ def getFactValue(item, attrName):
     returns the value of a fact (attribute) from an item
 
     iterates over the "facts" list - looking for a matching attributeId
-    to the paramater attrName
+    to the paramater attrName (or uses the index, for a CatalogObject)
     returns the "value" property or ""
     """
+    if isinstance(item, CatalogObject):
+        return item.getFactValue(attrName)
     # get the value of a specific fact from an item
     value = ""
     for facts in item["facts"]:
@@ -72,6 +186,24 @@ def getAllResource(url, user, pWd):
         return tResp.status_code, None
 
 
+def getAllResourceUsingSession(url, session):
+    """
+    get the list of resources in the catalog (name & type of each)
+
+    returns rc=200 (valid) & other rc's from the get
+            list of resources (json)
+    """
+    print("getting resources for catalog:-" + url)
+    apiURL = url + "/access/1/catalog/resources/"
+    header = {"Accept": "application/json"}
+    tResp = session.get(apiURL, params={}, headers=header)
+    print("\tresponse=" + str(tResp.status_code))
+    if tResp.status_code == 200:
+        return tResp.status_code, json.loads(tResp.text)
+    else:
+        return tResp.status_code, None
+
+
 def getResourceDefUsingSession(url, session, resourceName, sensitiveOptions=False):
     """
     get the resource definition - given a resource name (and catalog url)
@@ -267,6 +399,7 @@ def uploadResourceFileUsingSession(
     """
     upload a file for the resource - e.g. a custom lineage csv file
     works with either csv for zip files  (.csv|.zip)
+    the file is streamed (not read into memory)
 
     returns rc=200 (valid) & other rc's from the post
 
@@ -279,23 +412,20 @@ def uploadResourceFileUsingSession(
     print("\t" + str(params))
     #     files = {'file': fullPath}
     mimeType = "text/csv"
-    readMode = "rt"
     if fileName.endswith(".zip"):
         mimeType = "application/zip"
-        readMode = "rb"
 
     if fileName.endswith(".dsx"):
         mimeType = "text/plain"
 
-    file = {"file": (fileName, open(fullPath, readMode), mimeType)}
-    # file = {"file": (fileName, open(fullPath, readMode), )}
-    print(f"\t{file}")
     # print(f"session header:{session.headers}")
-    uploadResp = session.post(
-        apiURL,
-        data=params,
-        files=file,
-    )
+    with MultipartFileStream(params, fileName, fullPath, mimeType) as body:
+        print(f"\tfile={fullPath} {mimeType} bytes={len(body)}")
+        uploadResp = session.post(
+            apiURL,
+            data=body,
+            headers={"Content-Type": body.contentType},
+        )
     print("\tresponse=" + str(uploadResp.status_code))
     if uploadResp.status_code == 200:
         # valid - return the json
@@ -342,16 +472,17 @@ def uploadResourceFile(url, user, pWd, resourceName, fileName, fullPath, scanner
     if fileName.endswith(".dsx"):
         mimeType = "text/plain"
 
-    file = {"file": (fileName, open(fullPath, readMode), mimeType)}
-    print("\t" + str(file))
-    uploadResp = requests.post(
-        apiURL,
-        data=params,
-        files=file,
-        headers=header,
-        auth=HTTPBasicAuth(user, pWd),
-        verify=False,
-    )
+    with open(fullPath, readMode) as f:
+        file = {"file": (fileName, f, mimeType)}
+        print("\t" + str(file))
+        uploadResp = requests.post(
+            apiURL,
+            data=params,
+            files=file,
+            headers=header,
+            auth=HTTPBasicAuth(user, pWd),
+            verify=False,
+        )
     print("\tresponse=" + str(uploadResp.status_code))
     if uploadResp.status_code == 200:
         # valid - return the jsom
@@ -393,6 +524,95 @@ def executeResourceLoadUsingSession(url, session, resourceName):
         return uploadResp.status_code, None
 
 
+# load job status values - the job is finished when one of these is returned
+jobSuccessStates = ("COMPLETED", "SUCCEEDED", "SUCCESS")
+jobFailedStates = ("FAILED", "CANCELLED", "CANCELED", "ABORTED", "STOPPED")
+
+
+def getResourceLoadStatusUsingSession(url, session, jobId):
+    """
+    get the status of a resource load job (jobId from executeResourceLoad)
+
+    returns rc=200 (valid) & other rc's from the get
+            json with the job details (status, startTime, endTime, tasks...)
+    """
+    apiURL = url + "/access/2/catalog/resources/jobs/loads/" + jobId
+    header = {"accept": "application/json"}
+    statusResp = session.get(apiURL, headers=header)
+    if statusResp.status_code == 200:
+        return statusResp.status_code, json.loads(statusResp.text)
+    else:
+        print("\tjob status failed: " + str(statusResp.status_code))
+        print("\t" + str(statusResp.text))
+        return statusResp.status_code, None
+
+
+def waitForJobCompleteUsingSession(
+    url, session, jobId, pollInterval=5, maxPollInterval=60, timeout=0
+):
+    """
+    poll the status of a load job until it is finished
+    the poll interval doubles each time the status is unchanged (to maxPollInterval)
+
+    returns the final job status (e.g. COMPLETED, FAILED)
+            or None if the status could not be read, "TIMEOUT" if timeout
+            seconds passed before the job finished (timeout=0 - no limit)
+    """
+    print("waiting for job completion: " + jobId)
+    start = time.time()
+    interval = pollInterval
+    lastStatus = None
+    errors = 0
+    while True:
+        rc, jobJson = getResourceLoadStatusUsingSession(url, session, jobId)
+        elapsed = time.time() - start
+        if rc != 200:
+            errors += 1
+            if errors >= 3:
+                print(f"\tunable to get job status after {elapsed:.0f}s")
+                return None
+            status = lastStatus
+        else:
+            errors = 0
+            status = str(jobJson.get("status", "")).upper()
+            tasks = jobJson.get("tasks", [])
+            tasksDone = len(
+                [
+                    task
+                    for task in tasks
+                    if str(task.get("status", "")).upper() in jobSuccessStates
+                ]
+            )
+            if status != lastStatus:
+                # status changed - poll quickly again
+                interval = pollInterval
+            print(
+                f"\t{jobId} status={status} tasks completed={tasksDone}/"
+                f"{len(tasks)} elapsed={elapsed:.0f}s"
+            )
+            if status in jobSuccessStates or status in jobFailedStates:
+                print(f"job {jobId} finished: status={status} duration={elapsed:.1f}s")
+                return status
+        lastStatus = status
+
+        if timeout and elapsed >= timeout:
+            print(f"job {jobId} not finished after {elapsed:.0f}s - stopped waiting")
+            return "TIMEOUT"
+        time.sleep(min(interval, timeout - elapsed) if timeout else interval)
+        interval = min(interval * 2, maxPollInterval)
+
+
+def jobExitCode(status):
+    """
+    exit code for a final job status (from waitForJobCompleteUsingSession)
+    """
+    if status in jobSuccessStates:
+        return 0
+    if status in jobFailedStates:
+        return 2
+    return 3
+
+
 def executeResourceLoad(url, user, pWd, resourceName):
     """
     start a resource load
@@ -430,6 +650,85 @@ def executeResourceLoad(url, user, pWd, resourceName):
         return uploadResp.status_code, None
 
 
+def fileContentHash(fullPath):
+    """
+    hash of the lines in a file - the order of the lines is ignored
+    (lineage links are written in the order tables are read, which can vary)
+    for .zip files - the lines of the files in the archive are hashed
+    """
+    total = 0
+    if zipfile.is_zipfile(fullPath):
+        with zipfile.ZipFile(fullPath) as zf:
+            for name in sorted(zf.namelist()):
+                with zf.open(name) as f:
+                    total += linesHash(f)
+    else:
+        with open(fullPath, "rb") as f:
+            total += linesHash(f)
+    return format(total % (1 << 160), "040x")
+
+
+def linesHash(f):
+    """
+    sum of the sha1 of each line in a binary file object
+    """
+    total = 0
+    for line in f:
+        lineHash = hashlib.sha1(line.rstrip(b"\r\n")).digest()
+        total += int.from_bytes(lineHash, "big")
+    return total
+
+
+def isFileUnchanged(inputFileFullPath, fileName, prevFolder, url=None, session=None):
+    """
+    compare the content hash of a file with the last imported version
+    (stored in <prevFolder>/<fileName>.sha1)
+
+    if the last import was not waited for, the jobId is stored with the hash
+    and the job status is checked (using url & session) - the file is only
+    unchanged if that job completed or is still running
+
+    returns isUnchanged (bool), contentHash
+    """
+    contentHash = fileContentHash(inputFileFullPath)
+    hashFile = os.path.join(prevFolder, fileName + ".sha1")
+    if not os.path.isfile(hashFile):
+        print("\tno previous import found: " + hashFile)
+        return False, contentHash
+    with open(hashFile) as f:
+        prevHash, _, jobId = f.read().strip().partition(" ")
+    if prevHash != contentHash:
+        return False, contentHash
+    if not jobId:
+        return True, contentHash
+
+    # same content - but was the last import job successful?
+    if session is None:
+        print("\tlast import job was not checked: " + jobId)
+        return False, contentHash
+    rc, jobJson = getResourceLoadStatusUsingSession(url, session, jobId)
+    status = str(jobJson.get("status", "")).upper() if rc == 200 else None
+    print(f"\tlast import job {jobId} status={status}")
+    if status in jobSuccessStates:
+        saveImportedFileHash(fileName, prevFolder, contentHash)
+        return True, contentHash
+    if status is not None and status not in jobFailedStates:
+        # still queued/running - the job is checked again by the next run
+        return True, contentHash
+    return False, contentHash
+
+
+def saveImportedFileHash(fileName, prevFolder, contentHash, jobId=None):
+    """
+    store the content hash of a file that was imported (for isFileUnchanged)
+    jobId - the load job, if the import was not waited for (checked next run)
+    """
+    if not os.path.exists(prevFolder):
+        os.makedirs(prevFolder)
+    with open(os.path.join(prevFolder, fileName + ".sha1"), "w") as f:
+        f.write(contentHash if jobId is None else contentHash + " " + jobId)
+
+
 def createOrUpdateAndExecuteResourceUsingSession(
     url,
     session,
@@ -439,6 +738,8 @@ def createOrUpdateAndExecuteResourceUsingSession(
     inputFileFullPath,
     waitForComplete,
     scannerId,
+    prevFolder=None,
+    waitTimeout=0,
 ):
     """
     create or update resourceName  (new way with sessions)
@@ -449,8 +750,16 @@ def createOrUpdateAndExecuteResourceUsingSession(
     assumption - from the template, we are only changing the resource name,
                  and filename options - all else is already in the template
 
-    @todo:  add a diff process to determine if the input file is different to last time
-            - assume last file ins in what folder???
+    prevFolder - if set, the file is only imported if the content is different
+                 to the last file imported successfully (hash stored in
+                 prevFolder, with the jobId if not waitForComplete)
+    waitTimeout - seconds to wait for the scan to complete (0 - no limit)
+
+    returns 0 - the scan was started (& completed if waitForComplete)
+                or the file was unchanged
+            1 - the resource could not be created/updated or the scan started
+            2 - the scan failed (waitForComplete)
+            3 - the scan status is unknown, or waitTimeout passed
     """
     # check if the file to be uploaded exists
     if os.path.isfile(inputFileFullPath):
@@ -461,6 +770,18 @@ def createOrUpdateAndExecuteResourceUsingSession(
         #
         # else  (file content is the same)
         #   do nothing
+        contentHash = None
+        if prevFolder is not None:
+            isUnchanged, contentHash = isFileUnchanged(
+                inputFileFullPath, fileName, prevFolder, url, session
+            )
+            if isUnchanged:
+                print(
+                    "\tfile content is the same as the last import, "
+                    + "resource will not be updated/scanned: "
+                    + inputFileFullPath
+                )
+                return 0
 
         # get existing resource (so we know to create it or update it)
         validResource = False
@@ -567,12 +888,25 @@ def createOrUpdateAndExecuteResourceUsingSession(
                     print("\tJob Queued: " + loadJson.get("jobId"))
                     print("\tJob def: " + str(loadJson))
 
+                    exitCode = 0
                     if waitForComplete:
-                        print("waiting for job completion is not implemented yet")
+                        status = waitForJobCompleteUsingSession(
+                            url, session, loadJson.get("jobId"), timeout=waitTimeout
+                        )
+                        exitCode = jobExitCode(status)
+                        if contentHash is not None and exitCode == 0:
+                            saveImportedFileHash(fileName, prevFolder, contentHash)
+                    elif contentHash is not None:
+                        # not scanned yet - the next run checks the job status
+                        saveImportedFileHash(
+                            fileName, prevFolder, contentHash, loadJson.get("jobId")
+                        )
+                    return exitCode
                 else:
                     print("\tjob not started " + str(loadRc))
             else:
                 print("file not uploaded - resource/scan will not be started")
+        return 1
 
     else:
         # file does not exist
@@ -581,6 +915,7 @@ def createOrUpdateAndExecuteResourceUsingSession(
             + inputFileFullPath
             + " invalid or does not exist, exiting"
         )
+        return 1
 
 
 # end
@@ -596,6 +931,8 @@ def createOrUpdateAndExecuteResource(
     inputFileFullPath,
     waitForComplete,
     scannerId,
+    prevFolder=None,
+    waitTimeout=0,
 ):
     """
     create or update resourceName
@@ -607,8 +944,16 @@ def createOrUpdateAndExecuteResource(
     assumption - from the template, we are only changing the resource name,
                  and filename options - all else is already in the template
 
-    @todo:  add a diff process to determine if the input file is different to last time
-            - assume last file ins in what folder???
+    prevFolder - if set, the file is only imported if the content is different
+                 to the last file imported successfully (hash stored in
+                 prevFolder, with the jobId if not waitForComplete)
+    waitTimeout - seconds to wait for the scan to complete (0 - no limit)
+
+    returns 0 - the scan was started (& completed if waitForComplete)
+                or the file was unchanged
+            1 - the resource could not be created/updated or the scan started
+            2 - the scan failed (waitForComplete)
+            3 - the scan status is unknown, or waitTimeout passed
     """
     # check if the file to be uploaded exists
     if os.path.isfile(inputFileFullPath):
@@ -619,6 +964,23 @@ def createOrUpdateAndExecuteResource(
         #
         # else  (file content is the same)
         #   do nothing
+        # session for the job status calls
+        jobSession = requests.Session()
+        jobSession.auth = HTTPBasicAuth(user, pwd)
+        jobSession.verify = False
+
+        contentHash = None
+        if prevFolder is not None:
+            isUnchanged, contentHash = isFileUnchanged(
+                inputFileFullPath, fileName, prevFolder, url, jobSession
+            )
+            if isUnchanged:
+                print(
+                    "\tfile content is the same as the last import, "
+                    + "resource will not be updated/scanned: "
+                    + inputFileFullPath
+                )
+                return 0
 
         # get existing resource (so we know to create it or update it)
         validResource = False
@@ -721,12 +1083,25 @@ def createOrUpdateAndExecuteResource(
                     print("\tJob Queued: " + loadJson.get("jobId"))
                     print("\tJob def: " + str(loadJson))
 
+                    exitCode = 0
                     if waitForComplete:
-                        print("waiting for job completion is not implemented yet")
+                        status = waitForJobCompleteUsingSession(
+                            url, jobSession, loadJson.get("jobId"), timeout=waitTimeout
+                        )
+                        exitCode = jobExitCode(status)
+                        if contentHash is not None and exitCode == 0:
+                            saveImportedFileHash(fileName, prevFolder, contentHash)
+                    elif contentHash is not None:
+                        # not scanned yet - the next run checks the job status
+                        saveImportedFileHash(
+                            fileName, prevFolder, contentHash, loadJson.get("jobId")
+                        )
+                    return exitCode
                 else:
                     print("\tjob not started " + str(loadRc))
             else:
                 print("file not uploaded - resource/scan will not be started")
+        return 1
 
     else:
         # file does not exist
@@ -735,6 +1110,7 @@ def createOrUpdateAndExecuteResource(
             + inputFileFullPath
             + " invalid or does not exist, exiting"
         )
+        return 1
 
 
 def callGETRestEndpoint(apiURL, user, pWd):
@@ -0,0 +1,109 @@
+"""
+de-duplication store for lineage links (from id > to id)
+
+object ids are interned to ints, so each link is stored as a single int
+(from << 32 | to) in a set - O(1) to check & add.
+optionally - once max_edges links are held in memory, they are moved to a
+temporary sqlite file (spill), to keep memory bounded for very large runs
+
+Usage:
+    edges = EdgeStore()                  # memory only
+    edges = EdgeStore(max_edges=2000000, spill_folder="out")
+    if edges.add(from_id, to_id):
+        <write the link - it is new>
+    ...
+    edges.close()
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class EdgeStore:
+    """
+    set of (from id, to id) links with interned ids & optional spill to disk
+    """
+
+    def __init__(self, max_edges: int = 0, spill_folder: str = "."):
+        self.max_edges = max_edges
+        self.spill_folder = spill_folder
+        self.ids = {}  # key = object id, val=int
+        self.edges = set()
+        self.spilled_count = 0
+        self.spill_path = None
+        self.conn = None
+
+    def __len__(self):
+        return len(self.edges) + self.spilled_count
+
+    def __contains__(self, link):
+        from_id, to_id = link
+        from_nbr = self.ids.get(from_id)
+        to_nbr = self.ids.get(to_id)
+        if from_nbr is None or to_nbr is None:
+            return False
+        return self._contains(from_nbr << 32 | to_nbr)
+
+    def _intern(self, object_id: str):
+        nbr = self.ids.get(object_id)
+        if nbr is None:
+            nbr = len(self.ids)
+            self.ids[object_id] = nbr
+        return nbr
+
+    def _contains(self, edge: int):
+        if edge in self.edges:
+            return True
+        if self.conn is None:
+            return False
+        return (
+            self.conn.execute("select 1 from edges where edge=?", (edge,)).fetchone()
+            is not None
+        )
+
+    def add(self, from_id: str, to_id: str):
+        """
+        add a link, returns True if it is new, False if it was already added
+        """
+        edge = self._intern(from_id) << 32 | self._intern(to_id)
+        if self._contains(edge):
+            return False
+        self.edges.add(edge)
+        if self.max_edges and len(self.edges) >= self.max_edges:
+            self.spill()
+        return True
+
+    def spill(self):
+        """
+        move the in-memory links to the sqlite spill file
+        """
+        if self.conn is None:
+            if not os.path.exists(self.spill_folder):
+                os.makedirs(self.spill_folder)
+            fd, self.spill_path = tempfile.mkstemp(
+                prefix="edges_", suffix=".db", dir=self.spill_folder
+            )
+            os.close(fd)
+            self.conn = sqlite3.connect(self.spill_path)
+            self.conn.execute("pragma journal_mode=off")
+            self.conn.execute("pragma synchronous=off")
+            self.conn.execute("create table edges (edge integer primary key)")
+        self.conn.executemany(
+            "insert into edges values (?)", ((edge,) for edge in self.edges)
+        )
+        self.conn.commit()
+        self.spilled_count += len(self.edges)
+        logger.info("spilled %d lineage links to %s", len(self.edges), self.spill_path)
+        self.edges = set()
+
+    def close(self):
+        """
+        remove the spill file (if used)
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            os.remove(self.spill_path)
@@ -0,0 +1,586 @@
+"""
+tokenizer/parser for qlik load scripts (table expressions)
+
+strings, [bracketed] names, comments and semicolons inside them are handled:-
+    - the statements are found with one regex scan of the expression
+    - only statements that mention a .qvd file are parsed - the LOAD/FROM
+      keywords & column list are found by regex (brackets nested up to
+      max_nesting deep), then each column is split on AS & its fields found
+      (cached by the column list text - Concatenate LOADs of several qvds
+      often repeat the same list)
+    - anything the scans can't follow (e.g. deeper nesting) is parsed from
+      the tokens of the statement instead (same results, just slower)
+
+    Orders:
+    LOAD DISTINCT [Order Id], "Customer", Date(Floor(OrderDate)) AS OrderDate
+    FROM [lib://Data\\Sales\\Orders.qvd] (qvd);
+
+returns a QvdLoad for each LOAD ... FROM <x.qvd> statement with
+    qvd_path = lib://Data\\Sales\\Orders.qvd
+    table_ref = Orders
+    columns = {"Order Id": ["Order Id"], "Customer": ["Customer"],
+               "OrderDate": ["OrderDate"]}  (target column: source fields)
+"""
+import functools
+import hashlib
+import posixpath
+import re
+from collections import namedtuple
+
+# change when parse results change - so persisted results are not re-used
+parser_version = "3"
+
+QvdLoad = namedtuple(
+    "QvdLoad", ["statement_nbr", "statement", "qvd_path", "table_ref", "columns"]
+)
+
+# one token per match - the group name is the token kind
+# an unterminated quote ends at the end of the line/statement (e.g. REM don't..)
+# a : is only part of a word before a folder separator (lib://x, c:\x), so a
+# label is split from the statement - Orders:LOAD is Orders: & LOAD
+token_regex = re.compile(
+    r"""
+    (?P<ws>\s+)
+    |(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+    |(?P<dq>"(?:[^"\n]|"")*"|"[^\n;]*)
+    |(?P<sq>'(?:[^'\n]|'')*'|'[^\n;]*)
+    |(?P<br>\[(?:[^\]]|\]\])*\]|\[[^\n;]*)
+    |(?P<bt>`[^`\n]*`|`[^\n;]*)
+    |(?P<semi>;)
+    |(?P<comma>,)
+    |(?P<lp>\()
+    |(?P<rp>\))
+    |(?P<word>(?:[\w.$#@\\]|:(?=[/\\])|/(?![/*])|(?<=:)//)+:?)
+    |(?P<op>.)
+    """,
+    re.X | re.S,
+)
+
+# quoted tokens - the value is the text without the quotes
+quoted_kinds = ("dq", "sq", "br", "bt")
+
+# regex building blocks for the statement & column scans, matching the same
+# text as the tokens above - each character can only be matched one way, so a
+# scan that stops early (e.g. at an unbalanced bracket) does not backtrack far
+
+
+def quoted(open_quote: str, close_quote: str, line_only: bool = True):
+    """
+    regex for a quoted token e.g. "name" - as tokenized, it closes at the first
+    odd run of quotes (others are doubled "" quotes), if none before the last
+    quote, or is unterminated if there are no more quotes
+    line_only - the quotes can't span lines
+    """
+    o, c = re.escape(open_quote), re.escape(close_quote)
+    other = rf"[^{c}\n]" if line_only else rf"[^{c}]"
+    rest = r"[^\n]" if line_only else r"[\s\S]"
+    end = r"(?![^\n])" if line_only else r"\Z"
+    closed = rf"{other}*(?:{c}{c}{other}*)*{c}(?!{c})"
+    return (
+        rf"{o}{closed}"
+        rf"|{o}(?!{closed}){rest}*{c}(?={c}{other}*{end})"
+        rf"|{o}(?!{other}*{c})[^\n;]*(?![^\n;])"
+    )
+
+
+re_dq = quoted('"', '"')
+re_sq = quoted("'", "'")
+re_br = quoted("[", "]", line_only=False)
+re_bt = r"`[^`\n]*`|`(?![^`\n]*`)[^\n;]*(?![^\n;])"
+re_comment = r"(?<!:)//[^\n]*(?![^\n])|/\*[^*]*(?:\*(?!/)[^*]*)*(?:\*/|\Z)"
+re_word = r"(?:[\w.$#@\\]|:(?=[/\\])|/(?![/*])|(?<=:)//)+:?"
+re_blank = rf"(?:\s|{re_comment})*"
+re_quoted = rf"{re_dq}|{re_sq}|{re_br}|{re_bt}"
+# a / that is not a comment - a word after it is part of the atom, so
+# lib://FROM is not a keyword
+re_slash_word = r"(?:(?<=:)//|/(?![/*]))[\w.$#@\\]*(?![\w.$#@\\])"
+max_nesting = 6
+
+
+def nested_brackets(depth: int):
+    """
+    regex for a (bracketed) expression, with up to depth levels of brackets
+    """
+    run = r"[^\"'\[`/(),;]"
+    atom = rf"{run}+(?!{run})|{re_quoted}|{re_comment}|(?<=:)//|/(?![/*])"
+    group = rf"\((?:{atom}|,)*\)"
+    for _ in range(depth - 1):
+        group = rf"\((?:{atom}|,|{group})*\)"
+    return group
+
+
+def keyword(word: str):
+    """
+    regex for a keyword - a whole word as tokenized (Orders:LOAD is a keyword)
+    """
+    return rf"(?<![\w.$#@\\]){word}(?![\w.$#@\\:]|/(?![/*]))"
+
+
+re_nested = nested_brackets(max_nesting)
+
+
+def items(*keywords: str):
+    """
+    regex for the items of a column list - anything but a , (at the top level)
+    or ; up to one of the keywords. text that can't start a keyword is matched
+    in runs, so each item is a few characters or more
+    """
+    starts = "".join(sorted({word[0] + word[0].lower() for word in keywords}))
+    run = rf"[^\"'\[`/(),;{starts}]"
+    not_keyword = "".join(rf"(?!{keyword(word)})" for word in keywords)
+    return (
+        rf"(?:{run}+(?!{run})|{not_keyword}[{starts}]|{re_quoted}|{re_comment}"
+        rf"|{re_slash_word}|{re_nested})*"
+    )
+
+
+# one match per statement, ending with the ;
+# a statement starting with REM is a comment (up to the next ;)
+statement_regex = re.compile(
+    rf"""
+    (?:(?P<rem>{re_blank}REM(?![\w.$#@\\:]|/(?![/*]))[^;]*)
+    |(?:[^;"'\[`/]+|{re_dq}|{re_sq}|{re_br}|{re_bt}|(?<=:)//|{re_comment}|/)*)
+    (?:;|\Z)
+    """,
+    re.X | re.I,
+)
+
+# the first LOAD [DISTINCT] at the top level (not in brackets) - the load
+# group is optional so the match never fails
+load_regex = re.compile(
+    rf"""
+    (?:{items("LOAD")},)*{items("LOAD")}
+    (?:(?P<load>{keyword("LOAD")}){re_blank}(?:{keyword("DISTINCT")})?)?
+    """,
+    re.X | re.I,
+)
+# the column list - up to the first FROM at the top level
+column_list_regex = re.compile(
+    rf"(?:{items('FROM')},)*{items('FROM')}", re.X | re.I
+)
+# one column - up to the next top level , or FROM, with the AS <alias> if any
+column_regex = re.compile(
+    rf"""
+    {items("AS", "FROM")}
+    (?:(?P<alias>{keyword("AS")}){items("FROM")})?
+    (?P<comma>,)?
+    """,
+    re.X | re.I,
+)
+# FROM <qvd path>
+from_regex = re.compile(
+    rf"""
+    {keyword("FROM")}{re_blank}
+    (?:(?P<dq>{re_dq})|(?P<sq>{re_sq})|(?P<br>{re_br})|(?P<word>{re_word}))?
+    """,
+    re.X | re.I,
+)
+# the "quoted" & [bracketed] names in an expression (strings/comments skipped)
+field_regex = re.compile(
+    rf"""
+    ({re_dq}|{re_br})|{re_sq}|{re_bt}|(?<=:)//|{re_comment}
+    |[^"'\[`/]+|/
+    """,
+    re.X,
+)
+# the plain names in an expression, one per match (other tokens skipped) & a (
+# after the name for a function call - an empty match at the end
+plain_field_regex = re.compile(
+    rf"""
+    (?:{re_quoted}|{re_comment}|:(?![/\\])
+        |[^\w.$#@\\\"'\[`/:]+(?![^\w.$#@\\\"'\[`/:]))*
+    (?:({re_word})({re_blank}\()?|\Z)
+    """,
+    re.X,
+)
+# a single token, e.g. a [bracketed] alias
+single_token_regex = re.compile(
+    rf"""
+    {re_blank}(?:(?P<dq>{re_dq})|(?P<sq>{re_sq})|(?P<br>{re_br})|(?P<bt>{re_bt})
+        |(?P<word>{re_word})|(?P<op>[^\s/"'\[`])){re_blank}
+    """,
+    re.X,
+)
+blank_regex = re.compile(re_blank)
+qvd_regex = re.compile(r"\.qvd", re.I)
+
+
+def tokenize(expr: str):
+    """
+    yields (kind, value, start, end) for each token in the expression,
+    skipping white space and comments (// /* */ and REM ...; statements)
+    """
+    pos = 0
+    statement_start = True
+    while pos < len(expr):
+        match = token_regex.match(expr, pos)
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "ws" or kind == "comment":
+            continue
+        text = match.group()
+        if statement_start and kind == "word" and text.upper() == "REM":
+            # REM comments out the statement - up to the next ;
+            pos = expr.find(";", pos)
+            if pos < 0:
+                break
+            continue
+        statement_start = kind == "semi"
+        if kind in quoted_kinds:
+            text = unquote(kind, text)
+        yield kind, text, match.start(), match.end()
+
+
+def span_tokens(expr: str, start: int, end: int):
+    """
+    the tokens of expr[start:end] - a part of a statement (no REM check)
+    """
+    tokens = []
+    pos = start
+    while pos < end:
+        match = token_regex.match(expr, pos, end)
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "ws" or kind == "comment":
+            continue
+        text = match.group()
+        if kind in quoted_kinds:
+            text = unquote(kind, text)
+        tokens.append((kind, text, match.start(), pos))
+    return tokens
+
+
+def unquote(kind: str, text: str):
+    """
+    remove the quotes from a "name", 'string', [name] or `name` token
+    """
+    if kind == "br":
+        inner = text[1:-1] if text.endswith("]") else text[1:]
+        return inner.replace("]]", "]")
+    close = text[0]
+    inner = text[1:-1] if len(text) > 1 and text.endswith(close) else text[1:]
+    return inner.replace(close * 2, close)
+
+
+def expression_hash(expr: str):
+    """
+    hash of an expression (line endings & surrounding space normalised)
+    identical scripts have the same hash - so can share a parse result
+    """
+    normalised = expr.replace("\r\n", "\n").replace("\r", "\n").strip()
+    return hashlib.sha1(
+        (parser_version + "\n" + normalised).encode("utf-8")
+    ).hexdigest()
+
+
+def split_statements(expr: str):
+    """
+    yields (statement_nbr, start, body_end, end) for each ; separated statement
+    (body_end is before the ;), REM statements are skipped
+    """
+    st_nbr = 0
+    for match in statement_regex.finditer(expr):
+        end = match.end()
+        terminated = end > match.start() and expr[end - 1] == ";"
+        if not terminated and end == match.start():
+            # nothing after the last ;
+            break
+        st_nbr += 1
+        if match.group("rem") is None:
+            body_end = end - 1 if terminated else end
+            yield st_nbr, match.start(), body_end, end
+
+
+def parse_qvd_loads(expr: str):
+    """
+    parse an expression & return a list of QvdLoad - one per qvd load statement
+    """
+    loads = []
+    if not qvd_regex.search(expr):
+        return loads
+    for st_nbr, start, body_end, end in split_statements(expr):
+        if not qvd_regex.search(expr, start, body_end):
+            continue
+        load = parse_load_span(expr, start, body_end)
+        if load is not None:
+            qvd_path, columns = load
+            loads.append(
+                QvdLoad(
+                    st_nbr,
+                    expr[start:end],
+                    qvd_path,
+                    qvd_table_name(qvd_path),
+                    columns,
+                )
+            )
+    return loads
+
+
+def parse_load_span(expr: str, start: int, end: int):
+    """
+    returns (qvd_path, columns) if expr[start:end] is a LOAD ... FROM <x.qvd>
+    statement, or None
+    """
+    match = load_regex.match(expr, start, end)
+    columns_start = match.end()
+    if match.group("load") is None:
+        if columns_start < end:
+            # stopped at an unbalanced or deeply nested bracket
+            return parse_load_statement(span_tokens(expr, start, end), expr)
+        return None
+
+    columns_end = column_list_regex.match(expr, columns_start, end).end()
+    match = from_regex.match(expr, columns_end, end)
+    if match is None:
+        if columns_end < end:
+            return parse_load_statement(span_tokens(expr, start, end), expr)
+        return None
+    path_kind = match.lastgroup
+    if path_kind is None:
+        # FROM is not followed by a file name
+        return None
+    qvd_path = match.group(path_kind)
+    if path_kind != "word":
+        qvd_path = unquote(path_kind, qvd_path)
+    if not qvd_path.lower().endswith(".qvd"):
+        return None
+    return qvd_path, parse_columns(expr[columns_start:columns_end])
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_columns(text: str):
+    """
+    {target column: [source fields]} for a LOAD column list (up to the FROM)
+    cached - the same list is often loaded from many qvds, so the result is
+    shared & must not be changed
+    """
+    if blank_regex.fullmatch(text):
+        # no columns
+        return {}
+    columns = {}
+    pos = 0
+    while True:
+        match = column_regex.match(text, pos)
+        alias_start = match.start("alias") if match.group("alias") else None
+        col_end = match.end() - 1 if match.group("comma") else match.end()
+        to_col, fields = column_parts(text, pos, alias_start, col_end)
+        columns[to_col] = fields
+        if col_end == match.end():
+            return columns
+        pos = match.end()
+
+
+def column_parts(expr: str, start: int, alias_start, end: int):
+    """
+    (target column name, [source field names]) for the column expr[start:end]
+    with AS at alias_start (or None)
+    """
+    if alias_start is None:
+        return span_text(expr, start, end), expression_fields(expr, start, end)
+    alias = alias_start + len("AS")
+    return span_text(expr, alias, end), expression_fields(expr, start, alias_start)
+
+
+def parse_column(expr: str, start: int = 0, end: int = None):
+    """
+    returns (target column name, [source field names]) for one column
+    e.g. Upper("Name") AS [Customer Name]
+    """
+    if end is None:
+        end = len(expr)
+    match = column_regex.match(expr, start, end)
+    if match.end() < end or match.group("comma") is not None:
+        # a , FROM or bracket that the scan stops at - use the tokens
+        return column_mapping(span_tokens(expr, start, end), expr)
+    alias_start = match.start("alias") if match.group("alias") else None
+    return column_parts(expr, start, alias_start, end)
+
+
+def expression_fields(expr: str, start: int = 0, end: int = None):
+    """
+    the source fields referenced by an expression (see field_names)
+    """
+    if end is None:
+        end = len(expr)
+    fields = [
+        unquote("br" if text[0] == "[" else "dq", text)
+        for text in field_regex.findall(expr, start, end)
+        if text
+    ]
+    if fields:
+        return fields
+    match = single_token_regex.fullmatch(expr, start, end)
+    if match is not None:
+        return [token_value(match)]
+    return [
+        name
+        for name, call in plain_field_regex.findall(expr, start, end)
+        if name and not call and not name[0].isdigit()
+    ]
+
+
+def span_text(expr: str, start: int, end: int):
+    """
+    the text of expr[start:end] without [] or " quotes (see tokens_text)
+    """
+    match = single_token_regex.fullmatch(expr, start, end)
+    if match is not None:
+        return token_value(match)
+    return tokens_text(span_tokens(expr, start, end), expr)
+
+
+def token_value(match):
+    """
+    the value of a single_token_regex match - unquoted if quoted
+    """
+    kind = match.lastgroup
+    text = match.group(kind)
+    return unquote(kind, text) if kind in quoted_kinds else text
+
+
+def parse_load_statement(tokens: list, expr: str):
+    """
+    returns (qvd_path, columns) for a LOAD ... FROM <x.qvd> statement
+    or None if the statement does not read a qvd file
+    """
+    load_pos = None
+    from_pos = None
+    depth = 0
+    for pos, (kind, text, start, end) in enumerate(tokens):
+        if kind == "lp":
+            depth += 1
+        elif kind == "rp":
+            depth -= 1
+        elif kind == "word" and depth == 0:
+            keyword = text.upper()
+            if keyword == "LOAD" and load_pos is None:
+                load_pos = pos
+            elif keyword == "FROM" and load_pos is not None:
+                from_pos = pos
+                break
+    if from_pos is None or from_pos + 1 >= len(tokens):
+        return None
+
+    kind, qvd_path = tokens[from_pos + 1][:2]
+    if kind not in ("br", "sq", "dq", "word"):
+        return None
+    if not qvd_path.lower().endswith(".qvd"):
+        return None
+
+    col_tokens = tokens[load_pos + 1 : from_pos]
+    if col_tokens and col_tokens[0][0] == "word":
+        if col_tokens[0][1].upper() == "DISTINCT":
+            col_tokens = col_tokens[1:]
+
+    columns = {}
+    for col in split_columns(col_tokens):
+        to_col, fields = column_mapping(col, expr)
+        columns[to_col] = fields
+    return qvd_path, columns
+
+
+def split_columns(tokens: list):
+    """
+    split the tokens of a LOAD column list on commas (not inside brackets)
+    """
+    columns = []
+    col = []
+    depth = 0
+    for token in tokens:
+        kind = token[0]
+        if kind == "comma" and depth == 0:
+            columns.append(col)
+            col = []
+            continue
+        if kind == "lp":
+            depth += 1
+        elif kind == "rp":
+            depth -= 1
+        col.append(token)
+    if col or columns:
+        columns.append(col)
+    return columns
+
+
+def column_mapping(tokens: list, expr: str):
+    """
+    returns (target column name, [source field names]) for the tokens of
+    one column e.g. Upper("Name") AS [Customer Name]
+    expr is the text that was tokenized
+    """
+    as_pos = None
+    depth = 0
+    for pos, (kind, text, start, end) in enumerate(tokens):
+        if kind == "lp":
+            depth += 1
+        elif kind == "rp":
+            depth -= 1
+        elif kind == "word" and depth == 0 and text.upper() == "AS":
+            as_pos = pos
+            break
+
+    if as_pos is None:
+        expr_tokens = tokens
+        to_col = tokens_text(tokens, expr)
+    else:
+        expr_tokens = tokens[:as_pos]
+        to_col = tokens_text(tokens[as_pos + 1 :], expr)
+    return to_col, field_names(expr_tokens)
+
+
+def tokens_text(tokens: list, expr: str):
+    """
+    the text of a list of tokens, without [] or " quotes
+    """
+    if len(tokens) == 1:
+        return tokens[0][1]
+    if not tokens:
+        return ""
+    text = expr[tokens[0][2] : tokens[-1][3]]
+    return text.replace("[", "").replace("]", "").replace('"', "")
+
+
+def field_names(tokens: list):
+    """
+    the source fields referenced by an expression
+    - "quoted" or [bracketed] names if any are used
+    - otherwise, any plain names that are not function calls or numbers
+    """
+    fields = [text for kind, text, start, end in tokens if kind in ("dq", "br")]
+    if fields:
+        return fields
+    if len(tokens) == 1:
+        return [tokens[0][1]]
+    for pos, (kind, text, start, end) in enumerate(tokens):
+        if kind != "word" or text[0].isdigit():
+            continue
+        if pos + 1 < len(tokens) and tokens[pos + 1][0] == "lp":
+            # function call e.g. Date(...)
+            continue
+        fields.append(text)
+    return fields
+
+
+def qvd_table_name(qvd_path: str):
+    """
+    the table name for a qvd file - the file name without folder & .qvd
+    (\\ or / folder separators)
+    """
+    file_name = re.split(r"[\\/]", qvd_path.strip())[-1]
+    if file_name.lower().endswith(".qvd"):
+        file_name = file_name[: -len(".qvd")]
+    return file_name
+
+
+def normalise_qvd_path(qvd_path: str):
+    """
+    format a qvd file reference for comparison - case & slash insensitive, with
+    // . and .. folders removed
+    e.g. lib://Data\\Sales\\..\\Orders.qvd and lib://data/orders.qvd are the same
+    """
+    qvd_path = qvd_path.strip().replace("\\", "/").lower()
+    if not qvd_path:
+        return qvd_path
+    # lib://<connection>/<path> - only the path part is normalised
+    connection, sep, path = qvd_path.rpartition("://")
+    return connection + sep + posixpath.normpath(path)
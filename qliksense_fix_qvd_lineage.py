@@ -2,7 +2,7 @@
 Author:  dwrigley
 Purpose: if the qliksense scanner for EDC is not creating lineage between qvd tables
          this script will :-
-         - find any tables in the resource (-rn command-line parameter)
+         - find any tables in the resource(s) (-rn command-line parameter)
            - for each table
              - look at the expression attribute, if it has a (qvd) reference
                - find the referenced qvd table
@@ -16,30 +16,199 @@ Purpose: if the qliksense scanner for EDC is not creating lineage between qvd ta
 """
 import urllib3
 import argparse
+import asyncio
 import time
-from edcSessionHelper import EDCSession
+from edcSessionHelper import EDCSession, EDCAsyncSession
 import re
 import os
+import sys
+import contextvars
 import csv
+import fnmatch
+import io
+import json
+import logging
+import zipfile
 import edcutils
+import qlik_script_parser
+from edcutils import CatalogObject, getFactValue
+from catalog_cache import CatalogCache
+from debug_dump import DebugDump
+from edge_store import EdgeStore
+from run_metrics import RunMetrics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import as_completed
+from collections import deque
+from requests.adapters import HTTPAdapter
 
 urllib3.disable_warnings()
 
+logger = logging.getLogger("qliksense_fix_qvd_lineage")
 
+# qvd file written by a table e.g. STORE Orders INTO [lib://Data/Orders.qvd] (qvd);
+store_regex = r"STORE\s[^;]*?INTO\s*\[?([^\];]+?\.qvd)"
 
-class mem:
+
+class resource_state:
+    """
+    memory objects for one qliksense resource (-rn) - each resource processed
+    has its own (mem.<name> reads/writes the value for the current resource)
+    """
+
+    def __init__(self, resource_name: str = ""):
+        self.resource_name = resource_name
+        self.qvd_table_names = []
+        self.tables_to_find = []
+        self.qvd_table_sources = {}  # key = table name, val=list of qvd refs
+        self.qvd_table_sources_short = {}  # key = table name, val=list of table names
+        self.tab_cache = {}  # key = table name, val=table object (unique name)
+        # key = table name, val=list of table objects (>1 table with the name)
+        self.tab_candidates = {}
+        # key = normalised qvd path, val=table object found ({} if not found)
+        self.path_cache = {}
+        self.fLineage = None
+        self.lineageWriter = None  # csv.writer
+        self.lineage_cache: EdgeStore = EdgeStore()
+        self.tables_not_found = []
+        self.links_written = 0
+        self.pages_failed = 0  # pages of tables not read (after retries)
+        self.table_index = {}  # key = table name, val=list of table objects
+        # key = normalised qvd path (from STORE), val=list of objects
+        self.qvd_path_index = {}
+        # (target_obj, table_ref, qvd_path, st_refs) - index/batch
+        self.pending_links = []
+        self.not_found_cache = set()  # table names searched for & not found
+        self.col_index = {}  # key = table id, val=dict of column name: column id
+        # (table object, parse result, future) in read order
+        self.parse_queue = deque()
+        self.parse_futures = {}  # key = expression hash, val=future (being parsed)
+        self.edcAsyncSession: EDCAsyncSession = None  # --async
+        self.lineage_file = ""  # the file to import (csv or zip)
+        # zipfile.ZipFile, if the csv is written to a zip (--zip)
+        self.lineage_zip = None
+        # key = table id, val=hash/links/qvds from the last run
+        self.prev_manifest = {}
+        self.manifest = {}  # key = table id, val=hash/links/qvds for this run
+        self.tables_unchanged = 0
+        # qvd table names of unchanged tables - not searched (summary only)
+        self.tables_unchanged_refs = []
+        # progress (logged every --progress seconds)
+        self.tables_read = 0
+        self.tables_total = 0
+        self.progress_start = time.time()
+        self.progress_last = time.time()
+        # phase timings, http calls & cache hits - for the run report
+        self.metrics = RunMetrics()
+
+
+# the resource being processed by the current thread (or asyncio task)
+current_resource = contextvars.ContextVar("current_resource", default=resource_state())
+resource_fields = set(vars(resource_state()))
+
+
+class mem_type(type):
+    """
+    mem.<name> for a resource_state field is the value for the current resource
+    """
+
+    def __getattr__(cls, name):
+        if name in resource_fields:
+            return getattr(current_resource.get(), name)
+        raise AttributeError(name)
+
+    def __setattr__(cls, name, value):
+        if name in resource_fields:
+            setattr(current_resource.get(), name, value)
+        else:
+            super().__setattr__(name, value)
+
+
+class mem(metaclass=mem_type):
     # memory objects - easier than global vars
+    # (per resource objects are in resource_state)
     edcSession: EDCSession = EDCSession()
-    qvd_table_names = []
-    tables_to_find = []
-    qvd_table_sources = {}  # key = table name, val=list of qvd refs
-    qvd_table_sources_short = {}  # key = table name, val=list of table names
-    resource_name = ""
-    tab_cache = {}
-    lineageWriter = csv.writer
-    lineage_cache = []
-    tables_not_found = []
-    links_written = 0
+    page_size = 500
+    threads = 4
+    resource_threads = 4
+    use_index = False
+    batch_lookup = False
+    batch_size = 50
+    object_cache: CatalogCache = None  # persistent cache (--cache)
+    refresh_cache = False  # --refresh-cache: re-read, but update the cache
+    parse_cache = {}  # key = expression hash, val=list of QvdLoad
+    parse_store: CatalogCache = None  # persistent parse results (--parse-cache)
+    parse_hits = 0
+    parse_pool: ProcessPoolExecutor = None  # -pw parse workers
+    ignore_case = False
+    use_async = False
+    defer_links = False  # link qvd statements after all tables are read
+    incremental = False
+    progress_interval = 10  # seconds between progress messages, 0=none
+    debug_dump: DebugDump = None  # --debug-dump archive of expressions
+    # -qr qvd producer index (all resources) - tables that STORE qvd files
+    qvd_producer_paths = None  # key = normalised qvd path, val=dict of id: object
+    qvd_producer_files = {}  # key = qvd file name (lower case), val=dict of id: object
+
+
+def in_resource(func):
+    """
+    wrap func to run with the current resource - for ThreadPoolExecutor workers
+    """
+    state = current_resource.get()
+
+    def run(*args):
+        current_resource.set(state)
+        return func(*args)
+
+    return run
+
+
+class resource_filter(logging.Filter):
+    """
+    adds the current resource name to log records (%(resource)s)
+    """
+
+    def filter(self, record):
+        record.resource = current_resource.get().resource_name or "-"
+        return True
+
+
+def init_logging(args):
+    """
+    log to stdout - -q for warnings & errors only, --verbose to include table details
+    """
+    level = logging.INFO
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(resource_filter())
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s [%(resource)s] %(message)s")
+    )
+    logging.basicConfig(level=level, handlers=[handler])
+
+
+def log_progress(step: str, count: int, total: int):
+    """
+    log the progress of the current resource every --progress seconds
+    """
+    if not mem.progress_interval:
+        return
+    now = time.time()
+    if now - mem.progress_last < mem.progress_interval:
+        return
+    mem.progress_last = now
+    elapsed = now - mem.progress_start
+    logger.info(
+        "progress: %s %d/%d (%.1f/s), links written %d",
+        step,
+        count,
+        total,
+        count / elapsed if elapsed else 0.0,
+        len(mem.lineage_cache),
+    )
 
 
 def setup_cmd_parser():
@@ -73,7 +242,48 @@ def setup_cmd_parser():
         action="store_true",
         help=(
             "use the rest api to create the custom lineage resource "
-            "and start the import process"
+            "and start the import process - not imported (exit code 4) if any "
+            "page of tables could not be read"
+        ),
+    )
+
+    parser.add_argument(
+        "-z",
+        "--zip",
+        default=False,
+        action="store_true",
+        help=(
+            "write the lineage csv directly into a zip file "
+            "<outDir>/<resource>_lineage.zip (& import the zip with -i)"
+        ),
+    )
+
+    parser.add_argument(
+        "-w",
+        "--wait",
+        default=False,
+        action="store_true",
+        help=(
+            "with -i, wait for the lineage import to finish - the exit code is "
+            "0=completed/unchanged 1=not started 2=failed 3=unknown/timeout"
+        ),
+    )
+
+    parser.add_argument(
+        "--wait-timeout",
+        default=0,
+        type=int,
+        help="seconds to wait for the lineage import with -w (default 0 - no limit)",
+    )
+
+    parser.add_argument(
+        "-fi",
+        "--force-import",
+        default=False,
+        action="store_true",
+        help=(
+            "with -i, import the lineage csv even if the content is the same as "
+            "the last import (hash stored in <outDir>/prev)"
         ),
     )
 
@@ -82,23 +292,301 @@ def setup_cmd_parser():
         "--qliksense_resource",
         default="qliksense",
         required=True,
+        nargs="+",
         help=(
-            "custom lineage resource name to create/update - default value=qliksense"
+            "qliksense resource name(s) to process, or name patterns e.g. qlik_*  "
+            "the custom lineage resource <name>_lineage is created/updated for each"
+        ),
+    )
+
+    parser.add_argument(
+        "-qr",
+        "--qvd-resources",
+        default=[],
+        nargs="+",
+        help=(
+            "qliksense resource name(s) or patterns to find qvd files in, when "
+            "they are stored by a table in another resource - the tables that "
+            "STORE qvd files are read once (& cached with --cache)"
+        ),
+    )
+
+    parser.add_argument(
+        "-rt",
+        "--resource-threads",
+        default=4,
+        type=int,
+        help=(
+            "number of resources to process at the same time, when >1 resource "
+            "is used with -rn - default 4"
+        ),
+    )
+
+    parser.add_argument(
+        "-ps",
+        "--pagesize",
+        default=500,
+        type=int,
+        required=False,
+        help=("number of tables to request per catalog search page - default 500"),
+    )
+
+    parser.add_argument(
+        "-t",
+        "--threads",
+        default=4,
+        type=int,
+        required=False,
+        help=(
+            "max number of concurrent catalog page requests when finding tables "
+            "- default 4"
+        ),
+    )
+
+    parser.add_argument(
+        "-x",
+        "--index",
+        default=False,
+        action="store_true",
+        help=(
+            "index all tables in the resource while reading them, and resolve "
+            "qvd references from the index (no catalog search per referenced table)"
+        ),
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch",
+        default=False,
+        action="store_true",
+        help=(
+            "find all referenced qvd tables after reading the resource, using "
+            "one catalog search per --batchsize table names"
+        ),
+    )
+
+    parser.add_argument(
+        "-bs",
+        "--batchsize",
+        default=50,
+        type=int,
+        required=False,
+        help=("number of table names to find per catalog search (-b) - default 50"),
+    )
+
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        default=False,
+        action="store_true",
+        help=(
+            "use async http (aiohttp) to read all pages & find referenced tables "
+            "concurrently (max --concurrency requests at a time)"
+        ),
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        default=8,
+        type=int,
+        required=False,
+        help=("max concurrent catalog requests for --async - default 8"),
+    )
+
+    parser.add_argument(
+        "--incremental",
+        default=False,
+        action="store_true",
+        help=(
+            "only process tables with a changed expression (since the last "
+            "--incremental run), re-using the links of unchanged tables from "
+            "<outDir>/<resource>_lineage_manifest.json"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache",
+        default=False,
+        action="store_true",
+        help=(
+            "keep found tables in a persistent cache <outDir>/catalog_cache.db "
+            "and re-use them in later runs"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-ttl",
+        default=86400,
+        type=int,
+        required=False,
+        help=("seconds a cached table is valid for (--cache) - default 86400"),
+    )
+
+    parser.add_argument(
+        "--cache-not-found-ttl",
+        default=3600,
+        type=int,
+        required=False,
+        help=(
+            "seconds a table that was not found is remembered for, before "
+            "searching again (--cache) - default 3600"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        default=100000,
+        type=int,
+        required=False,
+        help=(
+            "max number of cached objects, least recently used are removed "
+            "(--cache) - default 100000"
+        ),
+    )
+
+    parser.add_argument(
+        "--refresh-cache",
+        default=False,
+        action="store_true",
+        help=(
+            "clear cached tables for the resource & re-read them (and the -qr "
+            "qvd producers) - implies --cache"
+        ),
+    )
+
+    parser.add_argument(
+        "-ic",
+        "--ignorecase",
+        default=False,
+        action="store_true",
+        help=(
+            "match column names case insensitive (& ignoring leading/trailing "
+            "spaces) when linking qvd columns"
+        ),
+    )
+
+    parser.add_argument(
+        "-pw",
+        "--parse-workers",
+        default=0,
+        type=int,
+        required=False,
+        help=(
+            "number of processes to parse table expressions with, while pages "
+            "are read & ids resolved - default 0 (parse in this process)"
+        ),
+    )
+
+    parser.add_argument(
+        "--parse-cache",
+        default=False,
+        action="store_true",
+        help=(
+            "keep expression parse results in <outDir>/parse_cache.db & re-use "
+            "them in later runs (identical scripts are always parsed once per run)"
+        ),
+    )
+
+    parser.add_argument(
+        "--edge-spill",
+        default=0,
+        type=int,
+        required=False,
+        help=(
+            "max lineage links to de-duplicate in memory, before moving them to "
+            "a temporary file in <outDir> - default 0 (memory only)"
+        ),
+    )
+
+    parser.add_argument(
+        "--debug-dump",
+        default=False,
+        action="store_true",
+        help=(
+            "write each table expression & qvd load statement to "
+            "<outDir>/debug_dump.zip (for checking the parse results)"
+        ),
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        default=False,
+        action="store_true",
+        help="only log warnings & errors (and the run summary)",
+    )
+
+    parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="log each table, statement & column (debug level)",
+    )
+
+    parser.add_argument(
+        "--progress",
+        default=10,
+        type=int,
+        required=False,
+        help=(
+            "seconds between progress messages (tables read/s, links written) "
+            "- default 10, 0=none"
         ),
     )
     return parser
 
 
 def find_qliksense_tables(resource_name: str):
-    print(f"finding tables in resource {resource_name}")
-    parameters = {
-        "offset": 0,
-        "pageSize": 500,
-        "q": 'core.classType:com.infa.ldm.bi.qlikSense.Table',
-        "fq": f"core.resourceName:{resource_name}",
-    }
-    #  -core.name:"Meta"
-    print(f"\t\tsearching using parms: {parameters}")
+    """
+    find all qliksense tables in the resource & process them
+
+    the first page is read to get the totalCount, the remaining pages are then
+    requested concurrently (bounded by mem.threads) and each page is processed
+    as soon as it arrives
+    """
+    logger.info("finding tables in resource %s", resource_name)
+    resultJson = get_qliksense_table_page(resource_name, 0)
+    if resultJson is None:
+        mem.pages_failed += 1
+        return None
+
+    total = resultJson["metadata"]["totalCount"]
+    mem.tables_total = total
+    logger.info("objects found: %d", total)
+    offsets = range(mem.page_size, total, mem.page_size)
+    logger.info("reading %d more pages using %d threads", len(offsets), mem.threads)
+
+    with ThreadPoolExecutor(max_workers=mem.threads) as executor:
+        # queue the remaining pages first, so they download while page 1 is processed
+        futures = {
+            executor.submit(
+                in_resource(get_qliksense_table_page), resource_name, offset
+            ): offset
+            for offset in offsets
+        }
+        for item in resultJson["items"]:
+            queue_qliksense_table(item)
+
+        for future in as_completed(futures):
+            page_json = future.result()
+            if page_json is None:
+                logger.error("error reading page at offset %d, skipping", futures[future])
+                mem.pages_failed += 1
+                continue
+            for item in page_json["items"]:
+                queue_qliksense_table(item)
+
+    # tables still waiting for the parse pool
+    process_parse_queue(wait=True)
+
+
+def get_qliksense_table_page(resource_name: str, offset: int):
+    """
+    read a single page of qliksense tables from the catalog
+    returns the result json, or None if the call failed
+    """
+    parameters = table_page_parameters(resource_name, offset)
+    logger.debug("searching using parms: %s", parameters)
 
     # execute catalog rest call, for a page of results
     resp = mem.edcSession.session.get(
@@ -108,146 +596,666 @@ def find_qliksense_tables(resource_name: str):
     status = resp.status_code
     if status != 200:
         # some error - e.g. catalog not running, or bad credentials
-        print("error! " + str(status) + str(resp.json()))
+        logger.error("error! %s %s", status, resp.text)
         return None
 
     resultJson = resp.json()
-    total = resultJson["metadata"]["totalCount"]
-    print(f"objects found: {total}")
+    # index the facts & links of each table (in the page thread)
+    resultJson["items"] = [CatalogObject(item) for item in resultJson["items"]]
+    return resultJson
+
+
+def table_page_parameters(resource_name: str, offset: int):
+    """
+    catalog search parameters for a page of qliksense tables in a resource
+    """
+    #  -core.name:"Meta"
+    return {
+        "offset": offset,
+        "pageSize": mem.page_size,
+        "q": "core.classType:com.infa.ldm.bi.qlikSense.Table",
+        "fq": f"core.resourceName:{resource_name}",
+    }
+
+
+async def find_qliksense_tables_async(resource_name: str):
+    """
+    async (--async) version of find_qliksense_tables, then find_ref_tables_async
+
+    all remaining pages are requested at once (mem.edcAsyncSession limits
+    how many are in flight) & each page is processed as it arrives
+    """
+    logger.info("finding tables in resource %s (async)", resource_name)
+    async with mem.edcAsyncSession:
+        resultJson = await get_qliksense_table_page_async(resource_name, 0)
+        if resultJson is None:
+            mem.pages_failed += 1
+            return None
+
+        total = resultJson["metadata"]["totalCount"]
+        mem.tables_total = total
+        logger.info("objects found: %d", total)
+        offsets = range(mem.page_size, total, mem.page_size)
+        logger.info(
+            "reading %d more pages, max %d at a time",
+            len(offsets),
+            mem.edcAsyncSession.max_concurrency,
+        )
+        pages = [
+            asyncio.ensure_future(get_qliksense_table_page_async(resource_name, offset))
+            for offset in offsets
+        ]
+        for item in resultJson["items"]:
+            queue_qliksense_table(item)
+
+        for next_page in asyncio.as_completed(pages):
+            page_json = await next_page
+            if page_json is None:
+                logger.error("error reading page, skipping")
+                mem.pages_failed += 1
+                continue
+            for item in page_json["items"]:
+                queue_qliksense_table(item)
 
-    for item in resultJson["items"]:
-        process_qliksense_table(item)
+        # tables still waiting for the parse pool
+        process_parse_queue(wait=True)
 
+        if not mem.use_index:
+            with mem.metrics.phase("resolve"):
+                await find_ref_tables_async(mem.tables_to_find)
 
-def process_qliksense_table(object: dict):
-    app_name = get_parent_obj_name(object)
+
+async def get_qliksense_table_page_async(resource_name: str, offset: int):
+    """
+    async version of get_qliksense_table_page
+    """
+    parameters = table_page_parameters(resource_name, offset)
+    logger.debug("searching using parms: %s", parameters)
+    status, resultJson = await mem.edcAsyncSession.getJson(
+        mem.edcAsyncSession.baseUrl + "/access/2/catalog/data/objects",
+        params=parameters,
+    )
+    if status != 200:
+        # some error - e.g. catalog not running, or bad credentials
+        logger.error("error! %s %s", status, resultJson)
+        return None
+
+    resultJson["items"] = [CatalogObject(item) for item in resultJson["items"]]
+    return resultJson
+
+
+def queue_qliksense_table(object: CatalogObject):
+    """
+    process a table - if a parse pool is used (-pw), the expression is sent to
+    the pool & the table is processed (in read order) when it is parsed
+    """
+    if mem.parse_pool is None:
+        process_qliksense_table(object)
+        return
+
+    table_expr = getFactValue(object, "com.infa.ldm.bi.qlikSense.Expression")
+    qvd_loads = None
+    future = None
+    if "(qvd)" in table_expr and not is_unchanged(object["id"], table_expr):
+        expr_hash = qlik_script_parser.expression_hash(table_expr)
+        future = mem.parse_futures.get(expr_hash)
+        if future is not None:
+            # same script is already being parsed
+            mem.parse_hits += 1
+        else:
+            qvd_loads = get_parsed_expression(expr_hash)
+            if qvd_loads is None:
+                future = mem.parse_pool.submit(parse_timed, table_expr)
+                mem.parse_futures[expr_hash] = future
+    mem.parse_queue.append((object, qvd_loads, future))
+    process_parse_queue()
+
+
+def process_parse_queue(wait: bool = False):
+    """
+    process the queued tables that are parsed (all of them if wait=True)
+    """
+    while mem.parse_queue:
+        object, qvd_loads, future = mem.parse_queue[0]
+        if future is not None and not future.done() and not wait:
+            return
+        mem.parse_queue.popleft()
+        if future is not None:
+            qvd_loads, seconds = future.result()
+            mem.metrics.add_phase("parse", seconds)
+            expr_hash = qlik_script_parser.expression_hash(
+                getFactValue(object, "com.infa.ldm.bi.qlikSense.Expression")
+            )
+            if mem.parse_futures.pop(expr_hash, None) is not None:
+                save_parsed_expression(expr_hash, qvd_loads)
+        process_qliksense_table(object, qvd_loads)
+
+
+def process_qliksense_table(object: CatalogObject, qvd_loads: list = None):
+    mem.tables_read += 1
+    log_progress("tables read", mem.tables_read, mem.tables_total)
     table_name = getFactValue(object, "core.name")
     table_expr = getFactValue(object, "com.infa.ldm.bi.qlikSense.Expression")
+    if mem.use_index:
+        index_table(object, table_name, table_expr)
+    if mem.incremental:
+        if is_unchanged(object["id"], table_expr):
+            reuse_manifest_entry(object["id"])
+            return
+        mem.manifest[object["id"]] = {
+            "name": table_name,
+            "hash": qlik_script_parser.expression_hash(table_expr),
+            "links": [],
+            "qvds": {},
+            "complete": True,
+        }
     has_qvd_ref = "(qvd)" in table_expr
-    print(f"processing table:{table_name} qvd_ref:{has_qvd_ref} app={app_name}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "processing table:%s qvd_ref:%s app=%s",
+            table_name,
+            has_qvd_ref,
+            get_parent_obj_name(object),
+        )
     if not has_qvd_ref:
-        print("\ttable has no qvd ref, skipping")
+        logger.debug("table has no qvd ref, skipping")
         return
     mem.qvd_table_names.append(table_name)
+    index_columns(object)
 
-    # write the expression to file
-    if not os.path.exists("tmp"):
-        print("creating folder ./tmp")
-        os.makedirs("tmp")
-
-    with open(f"./tmp/{table_name}", "w") as f:
-        f.write(table_expr.replace("\r", ""))
+    if mem.debug_dump is not None:
+        mem.debug_dump.write(f"{mem.resource_name}/{table_name}", table_expr)
 
     # extract the referenced qvd object(s) - there might be >1
-    extracted = extract_qvd_names(table_expr, table_name, object)
-    print(extracted)
+    extracted = extract_qvd_names(table_expr, table_name, object, qvd_loads)
+    logger.debug("%s", extracted)
     mem.tables_to_find.extend(extracted.keys())
     mem.qvd_table_sources[table_name] = list(extracted.values())
     mem.qvd_table_sources_short[table_name] = list(extracted.keys())
+    if mem.incremental:
+        mem.manifest[object["id"]]["qvds"] = extracted
 
 
-def extract_qvd_names(expr: str, tab_name: str, target_obj: dict):
-    qvds = {}
-    print("extracting qvd names from expr...")
-    statements = expr.split(";")
-    print(f"\texpression has {len(statements)} statements")
-    regex = r"\[([^]]+.qvd)\]"
-    col_regex = r",\s*(?![^()]*\))"
-
-    st_count = 0
-
-    for statement in statements:
-        print("\t\tstatement")
-        st_count += 1
-        for match in re.findall(regex, statement):
-            print(f"\t\t\tmatch...{match}")
-            with open(f"./tmp/{tab_name}_{st_count}", "w") as f:
-                f.write(statement.replace("\r", ""))
-
-            print("Statement with qvd>>>")
-            print(statement)
-            print("Statement with qvd<<<")
-            st_refs = {}
-            # get the table name - the last entry
-            table_ref = match.rsplit("\\")[-1].split(".qvd")[0]
-            qvds[table_ref] = match
-
-            # column extraction
-            load_pos = statement.upper().find("LOAD")
-            from_pos = statement.upper().find("FROM")
-            col_ref_stmnt = statement[load_pos + 4 : from_pos]
-            # get rid of any distinct
-            col_ref_stmnt = re.sub(r"distinct", "", col_ref_stmnt, flags=re.I)
-            col_stmnts = re.split(col_regex, col_ref_stmnt)
-            print(f"columns found... {len(col_stmnts)}")
-            for qvd_col in col_stmnts:
-                # col_stmnt = qvd_col.replace("")
-                print(f"\tcol:{qvd_col.strip()}")
-                to_col, fields = split_column_ref(qvd_col.strip())
-                st_refs[to_col] = fields
-
-            print(f"pos'-- {load_pos},{from_pos}")
-            print(st_refs)
-
-            # find the table
-            ref_table_dict = find_ref_table(table_ref)
-            if "id" in ref_table_dict:
-                print(f"ready to link id {ref_table_dict['id']} to {target_obj['id']}")
-                write_lineage(
-                    ref_table_dict["id"], target_obj["id"], "core.DataSetDataFlow"
-                )
+def is_unchanged(table_id: str, table_expr: str):
+    """
+    incremental mode - True if the table expression is the same as the last run
+    (and all of its qvd references were found)
+    """
+    entry = mem.prev_manifest.get(table_id)
+    if entry is None or not entry["complete"]:
+        return False
+    return entry["hash"] == qlik_script_parser.expression_hash(table_expr)
 
-                for ref_col in st_refs:
-                    print(f"\tfind col: {ref_col} in target_obj")
-                    to_col_id = get_col_id(target_obj, ref_col)
-                    for from_name in st_refs[ref_col]:
-                        from_col_id = get_col_id(ref_table_dict, from_name)
-                        if from_col_id is None or to_col_id is None:
-                            print("nones....")
-                            continue
-                        print(f"\t\tread to link fields... {from_col_id}>>{to_col_id}")
-                        write_lineage(
-                            from_col_id,
-                            to_col_id,
-                            "core.DirectionalDataFlow",
-                        )
-
-                # find  the columns
+
+def reuse_manifest_entry(table_id: str):
+    """
+    incremental mode - write the links of an unchanged table from the last run
+    """
+    entry = mem.prev_manifest[table_id]
+    mem.manifest[table_id] = entry
+    mem.tables_unchanged += 1
+    with mem.metrics.phase("csv_write"):
+        for link_type, from_id, to_id in entry["links"]:
+            write_lineage(from_id, to_id, link_type)
+    if entry["qvds"]:
+        mem.qvd_table_names.append(entry["name"])
+        mem.tables_unchanged_refs.extend(entry["qvds"].keys())
+        mem.qvd_table_sources[entry["name"]] = list(entry["qvds"].values())
+        mem.qvd_table_sources_short[entry["name"]] = list(entry["qvds"].keys())
+
+
+def load_manifest(out_folder: str):
+    """
+    incremental mode - read the manifest of the last run (if any)
+    """
+    manifest_file = os.path.join(
+        out_folder, mem.resource_name + "_lineage_manifest.json"
+    )
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            mem.prev_manifest = json.load(f).get("tables", {})
+    logger.info(
+        "incremental mode: %d tables in %s", len(mem.prev_manifest), manifest_file
+    )
+
+
+def save_manifest(out_folder: str):
+    """
+    incremental mode - write the table id: expression hash/links manifest
+    """
+    manifest_file = os.path.join(
+        out_folder, mem.resource_name + "_lineage_manifest.json"
+    )
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump({"resource": mem.resource_name, "tables": mem.manifest}, f)
+    os.replace(manifest_file + ".tmp", manifest_file)
+    logger.info("manifest written: %s (%d tables)", manifest_file, len(mem.manifest))
+
+
+def extract_qvd_names(
+    expr: str, tab_name: str, target_obj: CatalogObject, qvd_loads: list = None
+):
+    """
+    parse the expression (single pass) for LOAD ... FROM <x.qvd> statements
+    & link (or queue for linking) each referenced qvd table to target_obj
+    qvd_loads - the parse result, if already parsed (e.g. by the parse pool)
+    returns a dict of qvd table name: qvd file reference
+    """
+    qvds = {}
+    logger.debug("extracting qvd names from expr...")
+    if qvd_loads is None:
+        qvd_loads = parse_expression(expr)
+
+    for qvd_load in qvd_loads:
+        match = qvd_load.qvd_path
+        logger.debug("match...%s", match)
+        if mem.debug_dump is not None:
+            mem.debug_dump.write(
+                f"{mem.resource_name}/{tab_name}_{qvd_load.statement_nbr}",
+                qvd_load.statement,
+            )
+
+        logger.debug("Statement with qvd>>>\n%s\nStatement with qvd<<<", qvd_load.statement)
+        table_ref = qvd_load.table_ref
+        qvds[table_ref] = match
+        st_refs = qvd_load.columns
+        logger.debug("columns found... %d %s", len(st_refs), st_refs)
+
+        if mem.defer_links:
+            # all tables must be read before the reference can be resolved
+            mem.pending_links.append((target_obj, table_ref, match, st_refs))
+        else:
+            link_qvd_table(target_obj, table_ref, match, st_refs)
 
     return qvds
 
 
+def parse_expression(expr: str):
+    """
+    returns the QvdLoad list for an expression, parsing each distinct
+    expression once (cached by hash, optionally persisted across runs)
+    """
+    expr_hash = qlik_script_parser.expression_hash(expr)
+    qvd_loads = get_parsed_expression(expr_hash)
+    if qvd_loads is None:
+        qvd_loads, seconds = parse_timed(expr)
+        mem.metrics.add_phase("parse", seconds)
+        save_parsed_expression(expr_hash, qvd_loads)
+    return qvd_loads
+
+
+def parse_timed(expr: str):
+    """
+    parse an expression - returns the QvdLoad list & the seconds taken
+    (called in a -pw parse worker, or in this process)
+    """
+    start = time.perf_counter()
+    qvd_loads = qlik_script_parser.parse_qvd_loads(expr)
+    return qvd_loads, time.perf_counter() - start
+
+
+def get_parsed_expression(expr_hash: str):
+    """
+    returns the cached QvdLoad list for an expression hash, or None
+    """
+    qvd_loads = mem.parse_cache.get(expr_hash)
+    if qvd_loads is not None:
+        mem.parse_hits += 1
+        return qvd_loads
+
+    if mem.parse_store is not None:
+        stored = mem.parse_store.get("qlik_script_parser", expr_hash)
+        if stored is not None:
+            qvd_loads = [qlik_script_parser.QvdLoad(*load) for load in stored["loads"]]
+            mem.parse_cache[expr_hash] = qvd_loads
+    return qvd_loads
+
+
+def save_parsed_expression(expr_hash: str, qvd_loads: list):
+    """
+    cache the QvdLoad list for an expression hash (& persist if --parse-cache)
+    """
+    mem.parse_cache[expr_hash] = qvd_loads
+    if mem.parse_store is not None:
+        mem.parse_store.put("qlik_script_parser", expr_hash, {"loads": qvd_loads})
+
+
+def link_qvd_table(
+    target_obj: CatalogObject, table_ref: str, qvd_path: str, st_refs: dict
+):
+    """
+    find the table referenced by a qvd load statement & write the table and
+    column level lineage to target_obj
+    """
+    ref_table_dict = find_ref_table(table_ref, qvd_path)
+    table_id = target_obj["id"]
+    if "id" not in ref_table_dict and mem.incremental:
+        # process the table again next time - the qvd table might be found
+        mem.manifest[table_id]["complete"] = False
+    if "id" not in ref_table_dict:
+        return
+    # the column ids to link (from, to) - timed once per statement, not per link
+    with mem.metrics.phase("resolve"):
+        col_links = []
+        for ref_col in st_refs:
+            logger.debug("find col: %s in target_obj", ref_col)
+            to_col_id = get_col_id(target_obj, ref_col)
+            for from_name in st_refs[ref_col]:
+                from_col_id = get_col_id(ref_table_dict, from_name)
+                if from_col_id is None or to_col_id is None:
+                    logger.debug("column not found: %s>>%s", from_name, ref_col)
+                    continue
+                col_links.append((from_col_id, to_col_id))
+
+    with mem.metrics.phase("csv_write"):
+        logger.debug("ready to link id %s to %s", ref_table_dict["id"], table_id)
+        write_lineage(
+            ref_table_dict["id"], target_obj["id"], "core.DataSetDataFlow", table_id
+        )
+        for from_col_id, to_col_id in col_links:
+            logger.debug("ready to link fields... %s>>%s", from_col_id, to_col_id)
+            write_lineage(from_col_id, to_col_id, "core.DirectionalDataFlow", table_id)
+
+
+def link_pending_tables():
+    """
+    index/batch/async mode - resolve the qvd references collected while reading
+    the tables
+    """
+    logger.info("linking %d qvd references", len(mem.pending_links))
+    for link_count, (target_obj, table_ref, qvd_path, st_refs) in enumerate(
+        mem.pending_links, 1
+    ):
+        link_qvd_table(target_obj, table_ref, qvd_path, st_refs)
+        log_progress("qvd references linked", link_count, len(mem.pending_links))
+    mem.pending_links = []
+
+
+def index_table(object: CatalogObject, table_name: str, table_expr: str):
+    """
+    add a table to the in-memory index, by name and by any qvd file it stores
+    """
+    mem.table_index.setdefault(table_name, []).append(object)
+    for qvd_path in re.findall(store_regex, table_expr, flags=re.I):
+        mem.qvd_path_index.setdefault(normalise_qvd_path(qvd_path), []).append(
+            object
+        )
+
+
+def find_indexed_table(table_name: str, qvd_path: str):
+    """
+    index mode (-x) and/or the qvd producer index (-qr) - find the referenced
+    table by the qvd path it was stored to, then by a unique table/file name
+    (tables in the resource first, then the qvd producer index)
+    returns the table object or {} if not found
+    """
+    path_key = normalise_qvd_path(qvd_path)
+    producer_paths = mem.qvd_producer_paths or {}
+    producer_files = mem.qvd_producer_files
+    for candidates in (
+        mem.qvd_path_index.get(path_key, []),
+        list(producer_paths.get(path_key, {}).values()),
+        mem.table_index.get(table_name, []),
+        list(producer_files.get(qvd_file_name(path_key), {}).values()),
+    ):
+        ref_table = unique_table(candidates, qvd_path)
+        if ref_table:
+            return ref_table
+    return {}
+
+
+def unique_table(candidates: list, qvd_path: str):
+    """
+    returns the table to use from >1 candidates for a qvd path (or {})
+    - the table that stores the qvd path, or a table in the current resource
+    """
+    if len(candidates) > 1:
+        path_key = normalise_qvd_path(qvd_path)
+        candidates = [
+            object for object in candidates if path_key in stored_qvd_paths(object)
+        ] or candidates
+    if len(candidates) > 1:
+        candidates = [
+            object
+            for object in candidates
+            if getFactValue(object, "core.resourceName") == mem.resource_name
+        ] or candidates
+    if len(candidates) == 1:
+        return candidates[0]
+    if len(candidates) > 1:
+        logger.warning("%d tables found for %s...", len(candidates), qvd_path)
+    return {}
+
+
+def stored_qvd_paths(object: CatalogObject):
+    """
+    the normalised paths of the qvd files stored (STORE ... INTO) by a table
+    """
+    if "stores" in object:
+        stores = object["stores"]
+    else:
+        table_expr = getFactValue(object, "com.infa.ldm.bi.qlikSense.Expression")
+        stores = re.findall(store_regex, table_expr, flags=re.I)
+    return {normalise_qvd_path(qvd_path) for qvd_path in stores}
+
+
+def build_qvd_producer_index(patterns: list):
+    """
+    -qr - index the tables that STORE qvd files in the resource(s), by qvd path
+    and qvd file name, so qvd files from other resources can be found
+    """
+    mem.qvd_producer_paths = {}
+    mem.qvd_producer_files = {}
+    resource_names = find_resource_names(patterns)
+    logger.info("building qvd producer index for resources: %s", resource_names)
+    for resource_name in resource_names:
+        for producer in get_qvd_producers(resource_name):
+            index_qvd_producer(CatalogObject(producer))
+    logger.info("qvd producer index: %d qvd files", len(mem.qvd_producer_paths))
+
+
+def get_qvd_producers(resource_name: str):
+    """
+    returns the tables that STORE qvd files in a resource (see qvd_producer)
+    from the persistent cache (--cache) or read from the catalog
+    """
+    # cached as a separate "resource" - table names are keys for the resource
+    cache_resource = "qvd_producers:" + resource_name
+    if mem.object_cache is not None and not mem.refresh_cache:
+        cached = mem.object_cache.get(cache_resource, "producers")
+        if cached is not None:
+            logger.info("using persistent cache for qvd producers in %s", resource_name)
+            return cached["producers"]
+
+    first_page = get_qliksense_table_page(resource_name, 0)
+    if first_page is None:
+        return []
+    offsets = range(mem.page_size, first_page["metadata"]["totalCount"], mem.page_size)
+    logger.info("reading qvd producers in %s: %d pages", resource_name, len(offsets) + 1)
+    with ThreadPoolExecutor(max_workers=mem.threads) as executor:
+        pages = [first_page] + list(
+            executor.map(
+                lambda offset: get_qliksense_table_page(resource_name, offset), offsets
+            )
+        )
+
+    producers = []
+    for page in pages:
+        if page is None:
+            logger.error(
+                "error reading qvd producers in %s, index is incomplete", resource_name
+            )
+            return producers
+        for item in page["items"]:
+            producer = qvd_producer(item)
+            if producer is not None:
+                producers.append(producer)
+    if mem.object_cache is not None:
+        mem.object_cache.put(cache_resource, "producers", {"producers": producers})
+    return producers
+
+
+def qvd_producer(object: CatalogObject):
+    """
+    returns the id, name & columns of a table that stores qvd files
+    (+ "stores" - the qvd paths) or None if the table does not store a qvd file
+    """
+    table_expr = getFactValue(object, "com.infa.ldm.bi.qlikSense.Expression")
+    stores = re.findall(store_regex, table_expr, flags=re.I)
+    if not stores:
+        return None
+    return {
+        "id": object["id"],
+        "facts": [
+            fact
+            for fact in object["facts"]
+            if fact["attributeId"] in ("core.name", "core.resourceName")
+        ],
+        "dstLinks": object.getDstLinks("com.infa.ldm.bi.qlikSense.TableColumn"),
+        "stores": stores,
+    }
+
+
+def index_qvd_producer(object: CatalogObject):
+    """
+    add a qvd producer table to the index - by each qvd path & file name stored
+    """
+    for qvd_path in object["stores"]:
+        qvd_path = normalise_qvd_path(qvd_path)
+        mem.qvd_producer_paths.setdefault(qvd_path, {})[object["id"]] = object
+        mem.qvd_producer_files.setdefault(qvd_file_name(qvd_path), {})[
+            object["id"]
+        ] = object
+
+
+def normalise_qvd_path(qvd_path: str):
+    """
+    format a qvd file reference for comparison (see qlik_script_parser)
+    """
+    return qlik_script_parser.normalise_qvd_path(qvd_path)
+
+
+def qvd_file_name(qvd_path: str):
+    """
+    the file name of a normalised qvd path e.g. lib://data/sales/orders.qvd
+    -> orders.qvd
+    """
+    return qvd_path.rsplit("/", 1)[-1]
+
+
 def get_col_id(in_obj, name_to_find):
-    for dst_obj in in_obj["dstLinks"]:
-        if (
-            dst_obj["association"] == "com.infa.ldm.bi.qlikSense.TableColumn"
-            and dst_obj["name"] == name_to_find
-        ):
-            return dst_obj["id"]
+    """
+    returns the id of the column name_to_find in a table object, or None
+    """
+    return index_columns(in_obj).get(normalise_col_name(name_to_find))
+
+
+def index_columns(in_obj: CatalogObject):
+    """
+    returns the column name: id dict for a table object, built on first use
+    (first column found wins, if a name is duplicated)
+    """
+    col_ids = mem.col_index.get(in_obj["id"])
+    if col_ids is None:
+        col_ids = {}
+        for dst_obj in in_obj.getDstLinks("com.infa.ldm.bi.qlikSense.TableColumn"):
+            col_ids.setdefault(normalise_col_name(dst_obj["name"]), dst_obj["id"])
+        mem.col_index[in_obj["id"]] = col_ids
+    return col_ids
 
 
-def write_lineage(from_id, to_id, link_type):
-    key = from_id + ">" + to_id
-    if key not in mem.lineage_cache:
+def normalise_col_name(col_name: str):
+    """
+    column name as used in the column index (case insensitive if -ic is used)
+    """
+    if mem.ignore_case:
+        return col_name.strip().lower()
+    return col_name
+
+
+def write_lineage(from_id, to_id, link_type, table_id=None):
+    """
+    write a lineage link (once), table_id is the target table - to record the
+    link in the incremental manifest
+    """
+    if mem.lineage_cache.add(from_id, to_id):
         mem.lineageWriter.writerow([link_type, "", "", from_id, to_id])
-        mem.lineage_cache.append(key)
         mem.links_written += 1
+        if mem.incremental and table_id is not None:
+            mem.manifest[table_id]["links"].append([link_type, from_id, to_id])
 
 
-def find_ref_table(table_name):
-    print(f"finding table {table_name} in cache={table_name in mem.tab_cache}")
+def find_ref_table(table_name, qvd_path=""):
+    """
+    find the table that stores a qvd file - by the qvd path it was stored to,
+    or by the table (qvd file) name if that is unique
+    each qvd path is resolved once (unless the catalog search failed)
+    returns the table object or {} if not found
+    """
+    path_key = normalise_qvd_path(qvd_path)
+    mem.metrics.cache_hit("path_cache", path_key in mem.path_cache)
+    if path_key in mem.path_cache:
+        ref_table = mem.path_cache[path_key]
+    else:
+        with mem.metrics.phase("resolve"):
+            ref_table = resolve_ref_table(table_name, qvd_path)
+        if ref_table is None:
+            # the search failed - not cached, so the next reference searches again
+            ref_table = {}
+        elif path_key:
+            mem.path_cache[path_key] = ref_table
+    if not ref_table:
+        mem.tables_not_found.append(table_name)
+    return ref_table
+
+
+def resolve_ref_table(table_name, qvd_path):
+    """
+    find_ref_table - using the index(es), or a catalog search by name
+    returns the table object, {} if not found or None if the search failed
+    """
+    if mem.use_index or mem.qvd_producer_paths is not None:
+        ref_table = find_indexed_table(table_name, qvd_path)
+        if ref_table or mem.use_index:
+            # index mode - no catalog search, the index has every table
+            if not ref_table:
+                logger.debug("no indexed object found for %s", table_name)
+            return ref_table
+
+    candidates = find_named_tables(table_name)
+    if candidates is None:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    if len(candidates) > 1:
+        return unique_table(candidates, qvd_path)
+    return {}
+
 
+def find_named_tables(table_name):
+    """
+    returns the tables in the resource named table_name (from the caches or a
+    catalog search), or None if the search failed
+    """
+    mem.metrics.cache_hit("tab_cache", table_name in mem.tab_cache)
     if table_name in mem.tab_cache:
-        print(f"using cache for {table_name}")
-        return mem.tab_cache[table_name]
+        logger.debug("using cache for %s", table_name)
+        return [mem.tab_cache[table_name]]
 
-    parameters = {
-        "offset": 0,
-        "pageSize": 10,
-        "q": "core.classType:com.infa.ldm.bi.qlikSense.Table",
-        "fq": [f"core.resourceName:{mem.resource_name}", f'core.name:"{table_name}"'],
-    }
-    print(f"\t\tsearching using parms: {parameters}")
+    if table_name in mem.tab_candidates:
+        return mem.tab_candidates[table_name]
+
+    candidates = get_persisted_table(table_name)
+    if candidates is not None:
+        logger.debug("using persistent cache for %s", table_name)
+        return candidates
+
+    if is_known_not_found(table_name):
+        logger.debug("%s already searched for - not found", table_name)
+        return []
+
+    parameters = ref_table_parameters(table_name)
+    logger.debug("searching using parms: %s", parameters)
 
     # execute catalog rest call, for a page of results
     resp = mem.edcSession.session.get(
@@ -256,166 +1264,640 @@ def find_ref_table(table_name):
     )
     status = resp.status_code
     if status != 200:
-        # some error - e.g. catalog not running, or bad credentials
-        print("error! " + str(status) + str(resp.json()))
+        # some error (after retries) - e.g. catalog not running, or bad credentials
+        # not cached as not found - so the next reference will search again
+        logger.error("error! %s %s", status, resp.text)
         return None
 
-    resultJson = resp.json()
+    return save_ref_table_result(table_name, resp.json())
+
+
+def ref_table_parameters(table_name: str):
+    """
+    catalog search parameters to find a referenced table by name
+    """
+    return {
+        "offset": 0,
+        "pageSize": 100,
+        "q": "core.classType:com.infa.ldm.bi.qlikSense.Table",
+        "fq": [f"core.resourceName:{mem.resource_name}", f'core.name:"{table_name}"'],
+    }
+
+
+def save_ref_table_result(table_name: str, resultJson: dict):
+    """
+    cache the result of a referenced table search
+    returns the list of tables found
+    """
     total = resultJson["metadata"]["totalCount"]
-    print(f"objects found: {total}")
+    logger.debug("objects found: %d", total)
+    candidates = [CatalogObject(item) for item in resultJson["items"]]
 
     if total == 1:
-        mem.tab_cache[table_name] = resultJson["items"][0]
-        return resultJson["items"][0]
+        cache_table(table_name, candidates[0])
     elif total == 0:
-        print(f"no object found for or {table_name}")
+        logger.debug("no object found for %s", table_name)
+        cache_not_found(table_name, total)
     else:
-        print("0 or >1 items found...")
+        logger.debug("%d items found - the qvd path is used to find the table", total)
+        cache_candidates(table_name, candidates)
+    return candidates
 
-    mem.tables_not_found.append(table_name)
 
-    # return an empty dict if not found
-    return {}
+def find_ref_tables_batch(table_names):
+    """
+    find the referenced tables using OR'ed core.name searches, mem.batch_size
+    names per search (searches run concurrently, max mem.threads)
+    unique matches are stored in mem.tab_cache
+    """
+    names = names_to_find(table_names)
+    chunks = [
+        names[pos : pos + mem.batch_size] for pos in range(0, len(names), mem.batch_size)
+    ]
+    logger.info("finding %d tables using %d batch searches", len(names), len(chunks))
 
+    with ThreadPoolExecutor(max_workers=mem.threads) as executor:
+        results = list(executor.map(in_resource(find_ref_table_chunk), chunks))
+    save_batch_results(chunks, results)
 
-def split_column_ref(in_ref: str):
-    print(f"splitting col... {in_ref}")
-    ret = {}
-    to_col = in_ref
-    fm_expr = in_ref
-    split_ref = re.split(r"\s+AS\s+", in_ref, flags=re.I)
-    print(split_ref)
-    if len(split_ref) == 1:
-        pass
+
+async def find_ref_tables_async(table_names):
+    """
+    async (--async) - find all referenced tables concurrently, using
+    batch searches if -b is used, or a search per table name
+    """
+    names = names_to_find(table_names)
+    if mem.batch_lookup:
+        chunks = [
+            names[pos : pos + mem.batch_size]
+            for pos in range(0, len(names), mem.batch_size)
+        ]
+        logger.info(
+            "finding %d tables using %d batch searches", len(names), len(chunks)
+        )
+        results = await asyncio.gather(
+            *(find_ref_table_chunk_async(chunk) for chunk in chunks)
+        )
+        save_batch_results(chunks, results)
+        return
+
+    logger.info("finding %d tables using %d concurrent searches", len(names), len(names))
+    results = await asyncio.gather(
+        *(
+            mem.edcAsyncSession.getJson(
+                mem.edcAsyncSession.baseUrl + "/access/2/catalog/data/objects",
+                params=ref_table_parameters(name),
+            )
+            for name in names
+        )
+    )
+    for table_name, (status, resultJson) in zip(names, results):
+        if status != 200:
+            # not cached - find_ref_table will search again
+            logger.error("error! %s finding %s %s", status, table_name, resultJson)
+            continue
+        save_ref_table_result(table_name, resultJson)
+
+
+def names_to_find(table_names):
+    """
+    returns the sorted unique table names that are not cached (found or not found)
+    """
+    return sorted(
+        name
+        for name in set(table_names)
+        if name not in mem.tab_cache
+        and name not in mem.tab_candidates
+        and name.lower() + ".qvd" not in mem.qvd_producer_files
+        and not is_known_not_found(name)
+        and get_persisted_table(name) is None
+    )
+
+
+def save_batch_results(chunks: list, results: list):
+    """
+    cache the results of batch searches - the objects found for each chunk of
+    names, or None if the search failed (those names are not cached, so
+    find_ref_table will search again)
+    """
+    names = []
+    items = []
+    for chunk, chunk_items in zip(chunks, results):
+        if chunk_items is not None:
+            names.extend(chunk)
+            items.extend(chunk_items)
+    found = {}  # key = table name, val=list of matching objects
+    for item in items:
+        found.setdefault(getFactValue(item, "core.name"), []).append(item)
+
+    found_count = 0
+    for table_name in names:
+        items = found.get(table_name, [])
+        if len(items) == 1:
+            cache_table(table_name, items[0])
+            found_count += 1
+        elif len(items) > 1:
+            logger.debug("%d items found for %s", len(items), table_name)
+            cache_candidates(table_name, items)
+        else:
+            logger.debug("0 items found for %s", table_name)
+            cache_not_found(table_name, 0)
+    logger.info("batch search found %d of %d tables", found_count, len(names))
+
+
+def cache_table(table_name: str, ref_table: CatalogObject):
+    """
+    store a found table in mem.tab_cache (and the persistent cache if used)
+    """
+    mem.tab_cache[table_name] = ref_table
+    index_columns(ref_table)
+    if mem.object_cache is not None:
+        mem.object_cache.put(mem.resource_name, table_name, ref_table)
+
+
+def cache_candidates(table_name: str, candidates: list):
+    """
+    store the tables found for a name used by >1 table (see unique_table)
+    """
+    mem.tab_candidates[table_name] = candidates
+    for ref_table in candidates:
+        index_columns(ref_table)
+    if mem.object_cache is not None:
+        mem.object_cache.put(
+            mem.resource_name, table_name, {"candidates": candidates}
+        )
+
+
+def cache_not_found(table_name: str, found_count: int):
+    """
+    remember a table name that returned 0 objects, so it is searched once
+    """
+    mem.not_found_cache.add(table_name)
+    if mem.object_cache is not None:
+        mem.object_cache.put_not_found(mem.resource_name, table_name, found_count)
+
+
+def is_known_not_found(table_name: str):
+    """
+    returns True if the table name was already searched for & not found
+    (in this run, or in the persistent cache within --cache-not-found-ttl)
+    """
+    if table_name in mem.not_found_cache:
+        return True
+    if mem.object_cache is not None and mem.object_cache.is_not_found(
+        mem.resource_name, table_name
+    ):
+        mem.not_found_cache.add(table_name)
+        return True
+    return False
+
+
+def get_persisted_table(table_name: str):
+    """
+    read a table (or the tables for a name used by >1 table) from the
+    persistent cache (if used) into mem.tab_cache/mem.tab_candidates
+    returns the list of tables or None if not cached
+    """
+    if mem.object_cache is None:
+        return None
+    cached = mem.object_cache.get(mem.resource_name, table_name)
+    if cached is None:
+        return None
+    if "candidates" in cached:
+        candidates = [CatalogObject(item) for item in cached["candidates"]]
+        mem.tab_candidates[table_name] = candidates
     else:
-        to_col = split_ref[1]
-        fm_expr = split_ref[0]
+        candidates = [CatalogObject(cached)]
+        mem.tab_cache[table_name] = candidates[0]
+    for ref_table in candidates:
+        index_columns(ref_table)
+    return candidates
+
 
-    if "[" in to_col:
-        to_col = to_col.replace("[", "").replace("]", "")
-    if '"' in to_col:
-        to_col = to_col.replace('"', "")
+def find_ref_table_chunk(table_names: list):
+    """
+    search for all tables in the resource matching any of the names
+    returns a list of objects (all pages), or None if the search failed
+    """
+    parameters = ref_table_chunk_parameters(table_names)
+    items = []
+    total = 1
+    while parameters["offset"] < total:
+        resp = mem.edcSession.session.get(
+            mem.edcSession.baseUrl + "/access/2/catalog/data/objects",
+            params=parameters,
+        )
+        if resp.status_code != 200:
+            # some error - e.g. catalog not running, or bad credentials
+            logger.error("error! %s %s", resp.status_code, resp.text)
+            return None
+        resultJson = resp.json()
+        total = resultJson["metadata"]["totalCount"]
+        items.extend(CatalogObject(item) for item in resultJson["items"])
+        parameters["offset"] += parameters["pageSize"]
+    return items
+
+
+async def find_ref_table_chunk_async(table_names: list):
+    """
+    async version of find_ref_table_chunk
+    """
+    parameters = ref_table_chunk_parameters(table_names)
+    items = []
+    total = 1
+    while parameters["offset"] < total:
+        status, resultJson = await mem.edcAsyncSession.getJson(
+            mem.edcAsyncSession.baseUrl + "/access/2/catalog/data/objects",
+            params=parameters,
+        )
+        if status != 200:
+            # some error - e.g. catalog not running, or bad credentials
+            logger.error("error! %s %s", status, resultJson)
+            return None
+        total = resultJson["metadata"]["totalCount"]
+        items.extend(CatalogObject(item) for item in resultJson["items"])
+        parameters["offset"] += parameters["pageSize"]
+    return items
+
+
+def ref_table_chunk_parameters(table_names: list):
+    """
+    catalog search parameters to find all tables matching any of the names
+    """
+    name_query = " OR ".join(
+        '"' + name.replace('"', '\\"') + '"' for name in table_names
+    )
+    return {
+        "offset": 0,
+        "pageSize": max(100, len(table_names) * 2),
+        "q": "core.classType:com.infa.ldm.bi.qlikSense.Table",
+        "fq": [f"core.resourceName:{mem.resource_name}", f"core.name:({name_query})"],
+    }
 
-    print(f"to_col={to_col} expr={fm_expr}")
-    ref_fields = get_field_possibles(fm_expr)
-    ret[to_col] = ref_fields
 
-    print(f"returning:{ret}")
+def split_column_ref(in_ref: str):
+    """
+    split a single LOAD column e.g. Upper("Name") AS [Customer Name]
+    returns the target column name & list of source fields
+    """
+    logger.debug("splitting col... %s", in_ref)
+    to_col, ref_fields = qlik_script_parser.parse_column(in_ref)
+    logger.debug("returning:%s %s", to_col, ref_fields)
     return to_col, ref_fields
 
 
 def get_field_possibles(expr: str):
-    # check for quoted strings, [] strings and words or words_words
-    refs = []
-    quoted_strings = re.findall(r'"([^"]+)"', expr)
-    square_strings = re.findall(r"\[([^]]+)\]", expr)
-    refs.extend(quoted_strings)
-    refs.extend(square_strings)
-    if len(refs) == 0:
-        # find words
-        # if there is no "(" - just return the words
-        if "(" not in refs:
-            refs.append(expr)
-        else:
-            print("not sure what to do here")
-
-    print(f"\trefs={refs}")
+    """
+    returns the source field names referenced by a column expression
+    """
+    refs = qlik_script_parser.expression_fields(expr)
+    logger.debug("refs=%s", refs)
     return refs
 
 
-def get_parent_obj_name(object: dict):
+def get_parent_obj_name(object: CatalogObject):
     """
     given a qliksense object- look at the com.infa.ldm.bi.qlikSense.ApplicationTable
     association and get the name
     """
-    for assoc in object["srcLinks"]:
-        if assoc["association"] == "com.infa.ldm.bi.qlikSense.ApplicationTable":
-            return assoc["name"]
+    for assoc in object.getSrcLinks("com.infa.ldm.bi.qlikSense.ApplicationTable"):
+        return assoc["name"]
     # not found
     return "<<unknown>>"
 
 
-def getFactValue(item, attrName):
-    """
-    returns the value of a fact (attribute) from an item
-
-    iterates over the "facts" list - looking for a matching attributeId
-    to the paramater attrName
-    returns the "value" property or ""
-    """
-    # get the value of a specific fact from an item
-    value = ""
-    for facts in item["facts"]:
-        if facts.get("attributeId") == attrName:
-            value = facts.get("value")
-            break
-    return value
-
-
 def main():
     # read command-line parms, init edc connection and start the process
-    print("Qliksense EDC Scanner - QVD lineage fixer")
     start_time = time.time()
     cmd_parser = setup_cmd_parser()
     args, unknown = cmd_parser.parse_known_args()
+    init_logging(args)
+    logger.info("Qliksense EDC Scanner - QVD lineage fixer")
     # setup edc session and catalog url - with auth in the session header,
     # by using system vars or command-line args
     mem.edcSession.initUrlAndSessionFromEDCSettings()
-    print(f"command-line args parsed = {args} ")
+    logger.debug("command-line args parsed = %s", args)
 
     # since -rn is mandatoy, we only get here if a resource is specified
-    mem.resource_name = args.qliksense_resource
-    init_lineage(args.outDir)
-    find_qliksense_tables(mem.resource_name)
+    resource_names = find_resource_names(args.qliksense_resource)
+    if len(resource_names) == 0:
+        logger.error("no resources found for -rn %s", args.qliksense_resource)
+        return 1
+    mem.page_size = args.pagesize
+    mem.threads = max(1, args.threads)
+    mem.resource_threads = max(1, min(args.resource_threads, len(resource_names)))
+    mem.use_index = args.index
+    mem.ignore_case = args.ignorecase
+    mem.batch_lookup = args.batch and not args.index
+    mem.batch_size = max(1, args.batchsize)
+    mem.use_async = args.use_async
+    mem.defer_links = mem.use_index or mem.batch_lookup or mem.use_async
+    mem.incremental = args.incremental
+    mem.progress_interval = args.progress
+    if args.debug_dump:
+        mem.debug_dump = DebugDump(os.path.join(args.outDir, "debug_dump.zip"))
+    mem.refresh_cache = args.refresh_cache
+    if args.cache or args.refresh_cache:
+        mem.object_cache = CatalogCache(
+            os.path.join(args.outDir, "catalog_cache.db"),
+            ttl=args.cache_ttl,
+            max_entries=args.cache_size,
+            not_found_ttl=args.cache_not_found_ttl,
+        )
+    try:
+        if args.parse_workers > 0:
+            mem.parse_pool = ProcessPoolExecutor(max_workers=args.parse_workers)
+        if args.parse_cache:
+            # parse results are keyed by content - so never expire (lru eviction)
+            mem.parse_store = CatalogCache(
+                os.path.join(args.outDir, "parse_cache.db"),
+                ttl=10 * 365 * 86400,
+                max_entries=args.cache_size,
+            )
+        # allow a pooled connection per page thread (requests default is 10)
+        # shared by all resources
+        mem.edcSession.session.mount(
+            mem.edcSession.baseUrl,
+            HTTPAdapter(pool_maxsize=max(10, mem.threads * mem.resource_threads)),
+        )
+        # http calls are counted for the run report (of the current resource)
+        mem.edcSession.session.hooks["response"].append(record_http_response)
+        if args.qvd_resources:
+            build_qvd_producer_index(args.qvd_resources)
 
-    print(f"\nfound {len(mem.qvd_table_names)} tables to process")
-    print(
-        f"\t{len(mem.tables_to_find)} tables to find in edc, {len(set(mem.tables_to_find))} unique"
+        if len(resource_names) == 1:
+            results = [process_resource(resource_names[0], args)]
+        else:
+            logger.info(
+                "processing %d resources, %d at a time: %s",
+                len(resource_names),
+                mem.resource_threads,
+                resource_names,
+            )
+            with ThreadPoolExecutor(max_workers=mem.resource_threads) as executor:
+                results = list(
+                    executor.map(
+                        lambda name: process_resource(name, args), resource_names
+                    )
+                )
+    finally:
+        # the caches keep what was read, even if the run failed
+        if mem.parse_pool is not None:
+            mem.parse_pool.shutdown()
+        if mem.debug_dump is not None:
+            mem.debug_dump.close()
+        if mem.object_cache is not None:
+            mem.object_cache.close()
+        if mem.parse_store is not None:
+            mem.parse_store.close()
+    logger.info(
+        "expressions parsed: %d re-used: %d", len(mem.parse_cache), mem.parse_hits
     )
-    print("qvd references...")
-    print("qvd_file,qvd_table,used_by_table")
-    for k, v in mem.qvd_table_sources.items():
-        # print(f"\t{k}")
-        for qvd in v:
-            tab_name = qvd.rsplit("\\")[-1].split(".qvd")[0]
-            print(f"{qvd},{tab_name},{k}")
 
-    mem.fLineage.close()
+    retry_count = mem.edcSession.session.retry_count
+    retry_count += sum(result["retries"] for result in results)
+    print(f"requests retried: {retry_count}")
+    if len(results) == 1:
+        result = results[0]
+        print(f"tables found: {result['tables_found']}")
+        print(f"lineage links written: {result['links']}")
+        print(f"tables not found: {len(result['not_found'])}")
+        if len(result["not_found"]) > 0:
+            logger.info("%s", result["not_found"])
+    else:
+        print_summary(results)
     end_time = time.time()
+    print(f"Finished - run time = {end_time - start_time:.3f} seconds ---")
+    return max(result["exit_code"] for result in results)
+
+
+def find_resource_names(names: list):
+    """
+    resource names from -rn - names with * ? or [] are matched against
+    the qliksense resources in the catalog
+    """
+    patterns = [name for name in names if any(c in name for c in "*?[")]
+    resource_names = [name for name in names if name not in patterns]
+    if patterns:
+        rc, resources = edcutils.getAllResourceUsingSession(
+            mem.edcSession.baseUrl, mem.edcSession.session
+        )
+        if rc != 200:
+            logger.error("unable to list catalog resources to match: %s", patterns)
+            return []
+        for resource in resources:
+            name = resource.get("resourceName", "")
+            if name in resource_names:
+                continue
+            # skip other resource types - e.g. the <name>_lineage resources
+            if "qlik" not in resource.get("resourceTypeName", "qlik").lower():
+                continue
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                resource_names.append(name)
+    return resource_names
+
+
+def process_resource(resource_name: str, args):
+    """
+    find the qvd lineage for a resource - write (& import) the lineage file
+    returns a dict with the counts for the summary
+    """
+    start_time = time.time()
+    current_resource.set(resource_state(resource_name))
+    mem.lineage_cache = EdgeStore(max_edges=args.edge_spill, spill_folder=args.outDir)
+    if mem.use_async:
+        mem.edcAsyncSession = EDCAsyncSession(max_concurrency=max(1, args.concurrency))
+        mem.edcAsyncSession.initFromSession(mem.edcSession)
+        mem.edcAsyncSession.response_hooks.append(mem.metrics.record_http)
+    if args.refresh_cache:
+        logger.info("clearing cached tables for %s", mem.resource_name)
+        mem.object_cache.clear(mem.resource_name)
+    init_lineage(args.outDir, args.zip)
+    if mem.incremental:
+        load_manifest(args.outDir)
+    with mem.metrics.phase("crawl"):
+        if mem.use_async:
+            asyncio.run(find_qliksense_tables_async(mem.resource_name))
+        else:
+            find_qliksense_tables(mem.resource_name)
+    if mem.batch_lookup:
+        with mem.metrics.phase("resolve"):
+            find_ref_tables_batch(mem.tables_to_find)
+    if mem.defer_links:
+        link_pending_tables()
+    if mem.incremental and not mem.pages_failed:
+        # (if pages were not read, the last manifest is kept for the next run)
+        save_manifest(args.outDir)
+        logger.info("unchanged tables (links re-used): %d", mem.tables_unchanged)
+
+    logger.info("found %d tables to process", len(mem.qvd_table_names))
+    logger.info(
+        "%d tables to find in edc, %d unique (+%d from unchanged tables)",
+        len(mem.tables_to_find),
+        len(set(mem.tables_to_find)),
+        len(mem.tables_unchanged_refs),
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("qvd references...")
+        logger.debug("qvd_file,qvd_table,used_by_table")
+        for k, v in mem.qvd_table_sources.items():
+            for qvd in v:
+                tab_name = qlik_script_parser.qvd_table_name(qvd)
+                logger.debug("%s,%s,%s", qvd, tab_name, k)
+
+    with mem.metrics.phase("csv_write"):
+        mem.fLineage.close()
+        if mem.lineage_zip is not None:
+            mem.lineage_zip.close()
+    mem.lineage_cache.close()
 
     # starting custom linege import
-    if not args.edcimport:
-        print("lineage csv file is written but not imported into EDC, use -i flag to enable that")
+    exit_code = 0
+    if mem.pages_failed:
+        # the lineage is incomplete - importing it would remove links in edc
+        logger.error(
+            "%d page(s) of tables could not be read - lineage file %s is "
+            "incomplete and will not be imported",
+            mem.pages_failed,
+            mem.lineage_file,
+        )
+        exit_code = 4
+    elif not args.edcimport:
+        logger.info(
+            "lineage file %s is written but not imported into EDC, "
+            "use -i flag to enable that",
+            mem.lineage_file,
+        )
     else:
-        print("calling lineage import (-i flag used")
-        edcutils.createOrUpdateAndExecuteResourceUsingSession(
+        logger.info("calling lineage import (-i flag used)")
+        with mem.metrics.phase("import"):
+            exit_code = import_lineage(args)
+        # the upload & job start are single http calls (timed by the response hook)
+        for phase, endpoint in (
+            ("upload", "POST resources/<name>/files"),
+            ("job_launch", "POST resources/jobs/loads"),
+        ):
+            seconds = mem.metrics.endpoint_seconds(endpoint)
+            if seconds:
+                mem.metrics.add_phase(phase, seconds)
+
+    result = {
+        "resource": mem.resource_name,
+        "tables": len(mem.qvd_table_names),
+        "tables_found": len(
+            {ref_table["id"] for ref_table in mem.path_cache.values() if ref_table}
+        ),
+        "links": mem.links_written,
+        "not_found": mem.tables_not_found,
+        "retries": 0 if mem.edcAsyncSession is None else mem.edcAsyncSession.retry_count,
+        "exit_code": exit_code,
+        "seconds": time.time() - start_time,
+    }
+    write_run_report(args, result)
+    return result
+
+
+def import_lineage(args):
+    """
+    create/update the lineage resource, upload the lineage file & start the
+    import job (waiting for it with -w) - returns the exit code
+    """
+    return edcutils.createOrUpdateAndExecuteResourceUsingSession(
             mem.edcSession.baseUrl,
             mem.edcSession.session,
             mem.resource_name + "_lineage",
             "template/custom_lineage_template_no_auto.json",
-            mem.resource_name + "_lineage.csv",
-            args.outDir + "/" + mem.resource_name + "_lineage.csv",
-            False,
+            os.path.basename(mem.lineage_file),
+            mem.lineage_file,
+            args.wait,
             "LineageScanner",
+            None if args.force_import else args.outDir + "/prev",
+            args.wait_timeout,
         )
-        # end of main()
 
-    print(f"tables found: {len(mem.tab_cache)}")
-    print(f"lineage links written: {mem.links_written}")
-    print(f"tables not found: {len(mem.tables_not_found)}")
-    if len(mem.tables_not_found) >0 :
-        print(f"\t{mem.tables_not_found}")
-    print(f"Finished - run time = {end_time - start_time:.3f} seconds ---")
 
+def record_http_response(resp, *args, **kwargs):
+    """
+    requests response hook - http metrics for the current resource
+    """
+    mem.metrics.record_response(resp)
 
-def init_lineage(out_folder):
-    if not os.path.exists(out_folder):
-        print(f"creating folder ./{out_folder}")
-        os.makedirs(out_folder)
 
-    mem.fLineage = open(
-        os.path.join(out_folder, mem.resource_name + "_lineage.csv"), "w"
+def write_run_report(args, result: dict):
+    """
+    write <outDir>/<resource>_lineage_report.json - run counts, time per phase,
+    http calls per endpoint (with latency percentiles) & cache hit rates
+    """
+    report_file = os.path.join(args.outDir, f"{mem.resource_name}_lineage_report.json")
+    run_info = {
+        "resource": mem.resource_name,
+        "lineage_file": mem.lineage_file,
+        "seconds": result["seconds"],
+        "exit_code": result["exit_code"],
+        "mode": {
+            "index": mem.use_index,
+            "batch": mem.batch_lookup,
+            "async": mem.use_async,
+            "parse_workers": args.parse_workers,
+            "threads": mem.threads,
+            "incremental": mem.incremental,
+            "import": args.edcimport,
+        },
+        "counts": {
+            "tables_read": mem.tables_read,
+            "qvd_tables": result["tables"],
+            "tables_found": result["tables_found"],
+            "tables_not_found": len(result["not_found"]),
+            "links": result["links"],
+            "unchanged_tables": mem.tables_unchanged,
+            "pages_failed": mem.pages_failed,
+        },
+    }
+    mem.metrics.write_report(report_file, run_info)
+    logger.info("run report written: %s", report_file)
+
+
+def print_summary(results: list):
+    """
+    one line per resource processed (-rn with >1 resource)
+    """
+    print("\nresource summary...")
+    print("resource,qvd_tables,tables_found,tables_not_found,links,exit_code,seconds")
+    for result in results:
+        print(
+            f"{result['resource']},{result['tables']},{result['tables_found']},"
+            f"{len(result['not_found'])},{result['links']},{result['exit_code']},"
+            f"{result['seconds']:.1f}"
+        )
+    print(
+        f"total: resources={len(results)} "
+        f"links={sum(result['links'] for result in results)} "
+        f"tables not found={sum(len(result['not_found']) for result in results)}"
     )
+
+
+def init_lineage(out_folder, use_zip=False):
+    """
+    open the lineage csv file - or a csv stream in a zip file if use_zip
+    """
+    if not os.path.exists(out_folder):
+        logger.info("creating folder ./%s", out_folder)
+        os.makedirs(out_folder, exist_ok=True)
+
+    csv_name = mem.resource_name + "_lineage.csv"
+    if use_zip:
+        mem.lineage_file = os.path.join(out_folder, mem.resource_name + "_lineage.zip")
+        mem.lineage_zip = zipfile.ZipFile(
+            mem.lineage_file, "w", compression=zipfile.ZIP_DEFLATED
+        )
+        mem.fLineage = io.TextIOWrapper(
+            mem.lineage_zip.open(csv_name, "w", force_zip64=True),
+            encoding="utf-8",
+            newline="",
+        )
+    else:
+        mem.lineage_file = os.path.join(out_folder, csv_name)
+        mem.fLineage = open(mem.lineage_file, "w")
     mem.lineageWriter = csv.writer(mem.fLineage, lineterminator="\n")
     mem.lineageWriter.writerow(
         [
@@ -429,4 +1911,4 @@ def init_lineage(out_folder):
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
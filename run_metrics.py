@@ -0,0 +1,178 @@
+"""
+run metrics for the lineage fixer - written as a json run report
+
+collects (thread safe):-
+    phases  - seconds & count for each named step (e.g. crawl, parse, resolve)
+    http    - calls, errors & latency percentiles per endpoint
+    caches  - hit/miss counts (e.g. tab_cache)
+
+Usage:
+    metrics = RunMetrics()
+    session.hooks["response"].append(metrics.record_response)   # requests
+    with metrics.phase("crawl"):
+        ...
+    metrics.cache_hit("tab_cache", table_name in tab_cache)
+    metrics.write_report("out/qres_lineage_report.json", {"resource": "qres"})
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# endpoint names - resource names & job ids are replaced, so calls are grouped
+endpoint_patterns = [
+    (re.compile(r"^/access/\d+/catalog/"), ""),
+    (re.compile(r"^resources/jobs/loads/[^/]+$"), "resources/jobs/loads/<jobId>"),
+    (re.compile(r"^resources/(?!jobs/)[^/]+"), "resources/<name>"),
+]
+
+
+def endpoint_name(method: str, url: str):
+    """
+    e.g. GET https://edc:9085/access/1/catalog/resources/qres_lineage
+    returns "GET resources/<name>"
+    """
+    path = urlparse(url).path.rstrip("/")
+    for pattern, replacement in endpoint_patterns:
+        path = pattern.sub(replacement, path)
+    return f"{method} {path}"
+
+
+def percentiles(values: list):
+    """
+    p50, p90, p99, max & mean of a list of values (nearest rank)
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(pct):
+        return values[min(len(values) - 1, max(0, round(pct * len(values)) - 1))]
+
+    return {
+        "p50": rank(0.50),
+        "p90": rank(0.90),
+        "p99": rank(0.99),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+class RunMetrics:
+    """
+    phase timings, http call metrics & cache hit/miss counts for a run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}  # key = phase name, val=[seconds, count]
+        self.http = {}  # key = endpoint name, val=dict of calls/errors/latencies
+        self.caches = {}  # key = cache name, val=[hits, misses]
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        time a block of code - repeated/nested phases are added up
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float):
+        with self.lock:
+            totals = self.phases.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def record_http(self, method: str, url: str, status: int, seconds: float):
+        """
+        count a http call (each attempt - retries are counted separately)
+        """
+        with self.lock:
+            endpoint = self.http.setdefault(
+                endpoint_name(method, url), {"calls": 0, "errors": 0, "latencies": []}
+            )
+            endpoint["calls"] += 1
+            if status >= 400:
+                endpoint["errors"] += 1
+            endpoint["latencies"].append(seconds)
+
+    def record_response(self, resp, *args, **kwargs):
+        """
+        requests response hook - session.hooks["response"].append(...)
+        """
+        self.record_http(
+            resp.request.method,
+            resp.url,
+            resp.status_code,
+            resp.elapsed.total_seconds(),
+        )
+
+    def cache_hit(self, name: str, hit: bool):
+        with self.lock:
+            counts = self.caches.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def endpoint_seconds(self, endpoint: str):
+        """
+        total seconds for the calls to an endpoint (e.g. POST resources/<name>/files)
+        """
+        with self.lock:
+            return sum(self.http.get(endpoint, {}).get("latencies", []))
+
+    def report(self):
+        """
+        the metrics as a json serializable dict
+        """
+        with self.lock:
+            all_latencies = []
+            endpoints = {}
+            for name, endpoint in sorted(self.http.items()):
+                all_latencies.extend(endpoint["latencies"])
+                endpoints[name] = {
+                    "calls": endpoint["calls"],
+                    "errors": endpoint["errors"],
+                    "seconds": sum(endpoint["latencies"]),
+                    "latency": percentiles(endpoint["latencies"]),
+                }
+            return {
+                "phases": {
+                    name: {"seconds": seconds, "count": count}
+                    for name, (seconds, count) in self.phases.items()
+                },
+                "http": {
+                    "calls": len(all_latencies),
+                    "errors": sum(e["errors"] for e in endpoints.values()),
+                    "latency": percentiles(all_latencies),
+                    "endpoints": endpoints,
+                },
+                "caches": {
+                    name: {
+                        "hits": hits,
+                        "misses": misses,
+                        "hit_rate": hits / (hits + misses) if hits + misses else None,
+                    }
+                    for name, (hits, misses) in self.caches.items()
+                },
+            }
+
+    def write_report(self, report_path: str, run_info: dict):
+        """
+        write run_info + the metrics to a json file (via a .tmp file)
+        """
+        report = {
+            **run_info,
+            "started": time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(self.started)
+            ),
+            **self.report(),
+        }
+        with open(report_path + ".tmp", "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(report_path + ".tmp", report_path)